@@ -7,6 +7,8 @@ from time import localtime,mktime,strptime,time
 from calendar import timegm
 from datetime import datetime
 from subprocess import call,Popen,PIPE
+from itertools import imap,izip
+from multiprocessing import Pool
 from numpy import mean,std
 from scipy import optimize
 
@@ -23,115 +25,285 @@ gSystem.Load('libEvent')
 gSystem.Load('libDst')
 from ROOT import THPKT1_DST_EVENT,THPKT1_DST_NOTICE,THPKT1_DST_TIME,THPKT1_DST_THRESHOLD,THPKT1_DST_VOLTS # must load libDst first
 
-from plot import HalStamp,Plot
-from plot import convert_time,find_nearest_tuple,compute_bins
+from plot import HalStamp,Plot,PacketCache,RecordStore,derived_stores,lock_stores,unlock_stores,iter_packets,tree_cache_size
+from plot import flash_stats_dtype,HV_summary_dtype,board_summary_dtype,LED_temp_dtype,PTH_dtype
+from plot import hal_stamp_key,key_hal_stamp,notice_HV_calib_steps
+from plot import part_run_start,notice_records,HV_summary_records,merge_HV_summary
+from plot import packet_times,find_nearest_tuple,fill_arrays,fill_profile_moments,fit_lines,compute_bins,gaus_flash_stats
+
+def flash_stats_cluster_records(hal_stamp,event_packets,start,validate=0):
+  '''flash stats of each event of a part, numbered from 0'''
+  records = numpy.zeros(len(event_packets),dtype=flash_stats_dtype)
+  records['i'] = numpy.arange(len(records))
+  records['hal_stamp'] = hal_stamp_key(hal_stamp)
+  records['mirror'] = event_packets['pktHdr_crate']
+  records['tube'] = -1
+  # event time is measured as offset from first RUN START in milliseconds
+  records['t'] = start + 60*1000*event_packets['minute'].astype(numpy.int64) + event_packets['msec']
+  stats = gaus_flash_stats(event_packets['qdcB'],event_packets.offsets,validate)
+  for field,stat in zip(('hents','hmean','hRMS','const','mean','sigma'),stats) : records[field] = stat
+  return records
+
+class TubeHistograms:
+  '''counts of each QDC value of each (mirror,tube) and the sum of their event
+  times, accumulated a chunk of events at a time.  Memory is bounded by the
+  number of distinct (mirror,tube,QDC) values, not the number of events'''
+
+  def __init__(self):
+    self.keys = numpy.zeros(0,dtype=numpy.int64) # (mirror*256 + tube) << 32 | qdc
+    self.counts = numpy.zeros(0,dtype=numpy.int64)
+    self.tube_keys = numpy.zeros(0,dtype=numpy.int64)
+    self.times = numpy.zeros(0,dtype=numpy.int64)
+
+  def add(self,mirrors,tubes,qdc,times):
+    tube_keys = mirrors.astype(numpy.int64)*256 + tubes
+    self.keys,inverse = numpy.unique(numpy.concatenate((self.keys,(tube_keys << 32) | qdc.astype(numpy.int64))),return_inverse=True)
+    self.counts = numpy.bincount(inverse,numpy.concatenate((self.counts,numpy.ones(len(qdc),dtype=numpy.int64))),len(self.keys)).astype(numpy.int64)
+    self.tube_keys,inverse = numpy.unique(numpy.concatenate((self.tube_keys,tube_keys)),return_inverse=True)
+    self.times = numpy.bincount(inverse,numpy.concatenate((self.times,times)),len(self.tube_keys)).astype(numpy.int64)
+
+  def add_events(self,event_packets,start):
+    entries = event_packets.entries()
+    times = start + 60*1000*event_packets['minute'][entries].astype(numpy.int64) + event_packets['msec'][entries]
+    self.add(event_packets['pktHdr_crate'][entries],event_packets['tube_num'],event_packets['qdcB'],times)
+
+  def records(self,hal_stamp,validate=0):
+    '''flash stats of each (mirror,tube), numbered from 0'''
+    first = numpy.searchsorted(self.keys >> 32,self.tube_keys)
+    offsets = numpy.append(first,len(self.keys))
+    records = numpy.zeros(len(self.tube_keys),dtype=flash_stats_dtype)
+    records['i'] = numpy.arange(len(records))
+    records['hal_stamp'] = hal_stamp_key(hal_stamp)
+    records['mirror'],records['tube'] = self.tube_keys/256,self.tube_keys%256
+    stats = gaus_flash_stats(self.keys & 0xffffffff,offsets,validate,self.counts)
+    for field,stat in zip(('hents','hmean','hRMS','const','mean','sigma'),stats) : records[field] = stat
+    records['t'] = self.times/numpy.maximum(records['hents'],1) # average timestamp
+    return records
+
+def flash_stats_tube_records(hal_stamp,event_packets,start,validate=0,chunk=10000):
+  '''flash stats of each tube of each mirror of a part, numbered from 0, read
+  chunk events at a time'''
+  histograms = TubeHistograms()
+  for packets in event_packets.chunks(chunk) : histograms.add_events(packets,start)
+  return histograms.records(hal_stamp,validate)
+
+def compute_part_flash_stats(job):
+  '''(stats,hal_stamp,root_file,run_start,validate) -> cluster or tube flash
+  stats of the part.  Runs in a worker process, which opens its own ROOT file'''
+  stats,hal_stamp,root_file,start,validate = job
+  event_packets = PacketCache().get('led355',hal_stamp,'event',root_file)
+  if stats == 'cluster' : return flash_stats_cluster_records(hal_stamp,event_packets,start,validate)
+  elif stats == 'tube' : return flash_stats_tube_records(hal_stamp,event_packets,start,validate)
+
+def append_flash_stats(flash_stats,jobs,i,processes=1):
+  '''run compute_part_flash_stats jobs, in a pool of worker processes when
+  processes > 1, and append each part in job order, numbering the records on
+  from i'''
+  if processes > 1:
+    pool = Pool(processes)
+    parts = pool.imap(compute_part_flash_stats,jobs) # results come back in job order
+  else:
+    parts = imap(compute_part_flash_stats,jobs)
+  try:
+    for job,records in izip(jobs,parts):
+      hal_stamp = job[1]
+      records['i'] = numpy.arange(i,i + len(records))
+      i += len(records)
+      flash_stats.append_part(hal_stamp,records)
+      print '%s  %5d' % (hal_stamp,len(records))
+  finally:
+    if processes > 1: # every result is in, or a part failed
+      pool.terminate()
+      pool.join()
+
+def derive_part(job):
+  '''(hal_stamp,root_file,chunk) -> {store name:records} of every table
+  derived from a led355 part, read straight from its ROOT file in one pass,
+  chunk entries at a time.  The notices come first for the run start that
+  event times are measured from.  Parts without a file, the tree, its
+  branches or a run start are skipped, returning None.  Runs in a worker
+  process'''
+  hal_stamp,root_file,chunk = job
+  if not os.path.isfile(root_file): # journaled, but not renamed into place
+    print '%s  skipped, no file %s' % (hal_stamp,root_file)
+    return None
+  tfile = TFile(root_file)
+  tree = tfile.Get('T')
+  if tree == None or None in [tree.GetBranch(branch_type) for branch_type in ('notice','volts','event')]:
+    print '%s  skipped, no tree or branches in %s' % (hal_stamp,root_file)
+    tfile.Close()
+    return None
+  tree.SetCacheSize(tree_cache_size)
+  for branch_type in ('notice','volts','event') : tree.AddBranchToCache(branch_type,True)
+  start,LED_temps,PTH = None,[],[]
+  for packets in iter_packets(tree.GetBranch('notice'),'notice',chunk):
+    if start == None : start = part_run_start(packets)
+    records = notice_records(hal_stamp,packets)
+    LED_temps.append(records[0])
+    PTH.append(records[1])
+  if start == None:
+    print '%s  skipped, no RUN START in %s' % (hal_stamp,root_file)
+    tfile.Close()
+    return None
+  summary = (numpy.zeros(0,dtype=HV_summary_dtype),numpy.zeros(0,dtype=board_summary_dtype))
+  for packets in iter_packets(tree.GetBranch('volts'),'volts',chunk):
+    summary = merge_HV_summary(summary,HV_summary_records(hal_stamp,packets))
+  cluster,histograms = [],TubeHistograms()
+  for packets in iter_packets(tree.GetBranch('event'),'event',chunk):
+    cluster.append(flash_stats_cluster_records(hal_stamp,packets,start))
+    histograms.add_events(packets,start)
+  tfile.Close()
+  return {
+      'LED_temps':numpy.concatenate(LED_temps or [numpy.zeros(0,dtype=LED_temp_dtype)]),
+      'PTH':numpy.concatenate(PTH or [numpy.zeros(0,dtype=PTH_dtype)]),
+      'HV_summary':summary[0],
+      'board_summary':summary[1],
+      'flash_stats_cluster':numpy.concatenate(cluster or [numpy.zeros(0,dtype=flash_stats_dtype)]),
+      'flash_stats_tube':histograms.records(hal_stamp)}
+
+def refresh_parts(root_files,processes=1,chunk=10000,done=None):
+  '''bring every store derived from the led355 parts (flash stats, HV and
+  board summaries, LED temps and PTH) up to date with the parts in
+  root_files, {hal_stamp:root file}, e.g. those just converted.  Each part is
+  read once, a chunk at a time, by derive_part, in a pool of worker processes
+  when processes > 1, and its tables are appended in hal stamp order.  A
+  part that fails is logged and skipped.  done, if given, is called with each
+  hal stamp once it is appended or skipped'''
+  stores = derived_stores()
+  try:
+    lock_stores(stores.values())
+    for store in stores.values() : store.recover()
+    hal_stamps = sorted(root_files.keys(),key=hal_stamp_key)
+    i = {}
+    for stats in ('flash_stats_cluster','flash_stats_tube'):
+      last = stores[stats].last()
+      if last is None : i[stats] = 0 # new store
+      else : i[stats] = int(last['i']) + 1 # append to existing store
+    jobs = [(hal_stamp,root_files[hal_stamp],chunk) for hal_stamp in hal_stamps]
+    if processes > 1:
+      pool = Pool(processes)
+      parts = pool.imap(derive_part,jobs) # results come back in job order
+    else:
+      parts = imap(derive_part,jobs)
+    try:
+      for hal_stamp in hal_stamps:
+        try:
+          tables = parts.next() # a failed part raises here, and the next one follows
+        except Exception,error:
+          print >> sys.stderr,'%s  failed, skipped: %s' % (hal_stamp,error)
+          tables = None
+        if tables == None:
+          if done != None : done(hal_stamp)
+          continue
+        for stats in i:
+          tables[stats]['i'] = numpy.arange(i[stats],i[stats] + len(tables[stats]))
+          i[stats] += len(tables[stats])
+        for name in sorted(tables):
+          stores[name].append_part(hal_stamp,tables[name])
+        print '%s  %5d events' % (hal_stamp,len(tables['flash_stats_cluster']))
+        if done != None : done(hal_stamp)
+    finally:
+      if processes > 1: # every result is in, or a part failed
+        pool.terminate()
+        pool.join()
+  finally:
+    unlock_stores(stores.values())
 
 class HVCalib(Plot):
   '''investigate HV calibrations, and problems with the HV system'''
 
   def get_HV_calib_steps(self,hal_stamp):
-    '''return voltage steps used as the calibration voltage supply'''
-    step_voltages = {}
-    if hal_stamp == 'y2009m02d14p01' or hal_stamp == 'y2009m03d01p01':
-      '''iterate through the notice packets to find the manually entered supply voltages, and structure them by their associated mirror'''
-      notice_branch = self.data['hvcalib'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      mirror = 1
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        try:
-          voltage_step = float(re.search(r'^([0-9.]+)$',notice.text).group(1))
-        except:
-          continue
-        if len(step_voltages) == 0:
-          step_voltages[mirror] = [voltage_step]
-        elif voltage_step < step_voltages[mirror][-1]:
-          mirror += 1
-          step_voltages[mirror] = [voltage_step]
-        else:
-          step_voltages[mirror].append(voltage_step)
-    elif hal_stamp == 'y2009m08d10p01': pass
-    elif hal_stamp == 'y2009m08d10p02': pass
-    elif hal_stamp == 'y2009m08d10p03': pass
-    elif hal_stamp == 'y2009m08d10p04': pass
-    elif hal_stamp == 'y2009m08d10p05': pass
-    elif hal_stamp == 'y2009m08d10p06': pass
-    elif hal_stamp == 'y2009m08d10p07': pass
-    elif hal_stamp == 'y2009m08d10p08': pass
-    elif hal_stamp == 'y2009m08d10p09': pass
-    elif hal_stamp == 'y2009m08d10p10': pass
-    elif hal_stamp == 'y2009m08d10p11': pass
-    elif hal_stamp == 'y2009m08d10p12': pass
-    elif hal_stamp == 'y2009m08d21p01':
-      for mirror in xrange(1,self.mirrors + 1):
-        step_voltages[mirror] = (401,)
-    elif hal_stamp == 'y2009m08d21p02':
-      for mirror in xrange(1,self.mirrors + 1):
-        step_voltages[mirror] = (597,)
-    elif hal_stamp == 'y2009m08d21p03':
-      for mirror in xrange(1,self.mirrors + 1):
-        step_voltages[mirror] = (596,)
-    elif hal_stamp == 'y2009m08d21p04':
-      for mirror in xrange(1,self.mirrors + 1):
-        step_voltages[mirror] = (796,)
-    elif hal_stamp == 'y2009m08d21p05':
-      for mirror in xrange(1,self.mirrors + 1):
-        step_voltages[mirror] = (1000,)
-    elif hal_stamp == 'y2009m08d21p06':
-      for mirror in xrange(1,self.mirrors + 1):
-        step_voltages[mirror] = (1197,)
-    elif hal_stamp == 'y2009m08d21p07':
-      for mirror in xrange(1,self.mirrors + 1):
-        step_voltages[mirror] = (1398,)
+    '''return voltage steps used as the calibration voltage supply, from the
+    step table or, for parts whose steps were entered as notices, from the
+    notices (extracted once, then kept in the catalog)'''
+    step_voltages = self.HV_calib_steps.get(str(hal_stamp),{})
+    if step_voltages == 'notice':
+      catalog = self.data_object.catalog
+      part = catalog.parts[('hvcalib',str(hal_stamp))]
+      if not 'HV_calib_steps' in part:
+        part['HV_calib_steps'] = notice_HV_calib_steps(self.get_packets(hal_stamp,'hvcalib','notice'))
+        catalog.save()
+      step_voltages = part['HV_calib_steps']
     return step_voltages
 
-  def get_HV_calib(self):
-    HV_calib = {}
-    for hal_stamp in self.data['hvcalib'].keys():
-      if re.match(r'y2009m08d10',hal_stamp) : continue
-      HV_calib[hal_stamp] = {}
+  def get_HV_calib_points(self,mirrors=None):
+    '''(measured,supplied) volts of every tube of every volts packet of the
+    hvcalib parts, as flat arrays with the hal stamp key, mirror and tube of
+    each point.  Each packet is assigned to the calibration step nearest its
+    mean hv once, in one pass over each part'''
+    parts = []
+    for hal_stamp in sorted(self.data['hvcalib'].keys()):
+      if re.match(r'y2009m08d10',str(hal_stamp)) : continue
       step_voltages = self.get_HV_calib_steps(hal_stamp)
-      volts_branch = self.data['hvcalib'][hal_stamp]['volts']
-      volts = THPKT1_DST_VOLTS()
-      volts_branch.SetAddress(AddressOf(volts))
-      for mirror in sorted(step_voltages.keys()):
-        if not mirror == 6 : continue
-        HV_calib[hal_stamp][mirror] = {}
-        for entry in xrange(volts_branch.GetEntries()):
-          volts_branch.GetEntry(entry)
-          if not mirror == volts.pktHdr_crate : continue
-          for tube in xrange(volts.hvChnls):
-            mean = float(sum(volts.hv))/len(volts.hv)
-            step_voltage = min(step_voltages[mirror],key=lambda step : fabs(step - mean))
-            if not tube in HV_calib[hal_stamp][mirror]:
-              HV_calib[hal_stamp][mirror][tube] = {'measured volts':[],'supplied volts':[]}
-            HV_calib[hal_stamp][mirror][tube]['measured volts'].append(volts.hv[tube] - self.volts_ped)
-            HV_calib[hal_stamp][mirror][tube]['supplied volts'].append(step_voltage)
+      if mirrors != None:
+        step_voltages = dict((mirror,steps) for mirror,steps in step_voltages.items() if mirror in mirrors)
+      if not step_voltages : continue
+      parts.append((hal_stamp,step_voltages,self.get_packets(hal_stamp,'hvcalib','volts')))
+    points = dict((field,numpy.zeros(sum(len(volts_packets['hv']) for hal_stamp,step_voltages,volts_packets in parts),dtype=dtype))
+        for field,dtype in (('hal_stamp',numpy.int64),('mirror',numpy.int16),('tube',numpy.int16),('measured volts',numpy.float64),('supplied volts',numpy.float64)))
+    n = 0
+    for hal_stamp,step_voltages,volts_packets in parts:
+      crates = volts_packets['pktHdr_crate']
+      counts = numpy.diff(volts_packets.offsets)
+      entries = volts_packets.entries()
+      means = numpy.bincount(entries,volts_packets['hv'],len(counts))/numpy.maximum(counts,1)
+      # nearest step of each packet of the mirrors with steps
+      supplied = numpy.zeros(len(counts))
+      selected = numpy.zeros(len(counts),dtype=bool)
+      for mirror,steps in step_voltages.items():
+        packets = crates == mirror
+        steps = numpy.asarray(steps,dtype=numpy.float64)
+        supplied[packets] = steps[numpy.abs(means[packets,None] - steps[None,:]).argmin(axis=1)]
+        selected |= packets
+      values = selected[entries]
+      stop = n + values.sum()
+      points['hal_stamp'][n:stop] = hal_stamp_key(hal_stamp)
+      points['mirror'][n:stop] = crates[entries][values]
+      points['tube'][n:stop] = (numpy.arange(len(entries)) - volts_packets.offsets[entries])[values]
+      points['measured volts'][n:stop] = volts_packets['hv'][values] - self.volts_ped
+      points['supplied volts'][n:stop] = supplied[entries][values]
+      n = stop
+    return dict((field,points[field][:n]) for field in points)
+
+  def get_HV_calib(self,mirrors=None):
+    '''{hal_stamp:{mirror:{tube:{'measured volts','supplied volts'}}}} of the
+    calibration points, as arrays'''
+    points = self.get_HV_calib_points(mirrors)
+    order = numpy.lexsort((points['tube'],points['mirror'],points['hal_stamp']))
+    keys = numpy.array([points[field][order] for field in ('hal_stamp','mirror','tube')]).T
+    first = numpy.flatnonzero(numpy.concatenate(([True],(keys[1:] != keys[:-1]).any(axis=1)))) if len(order) else []
+    HV_calib = {}
+    for group in numpy.split(order,first[1:]):
+      if not len(group) : continue
+      hal_stamp,mirror,tube = key_hal_stamp(points['hal_stamp'][group[0]]),int(points['mirror'][group[0]]),int(points['tube'][group[0]])
+      HV_calib.setdefault(hal_stamp,{}).setdefault(mirror,{})[tube] = {'measured volts':points['measured volts'][group],'supplied volts':points['supplied volts'][group]}
     return HV_calib
 
-  def get_HV_calib_pars(self,fit='2par'):
-    HV_calib = self.get_HV_calib()
+  def get_HV_calib_pars(self,fit='2par',mirrors=None,arrays=False):
+    '''fit supplied volts = m*measured volts (+ b) for every tube of every
+    hvcalib part in one batch.  Returns {hal_stamp:{mirror:{tube:pars}}}, or
+    with arrays a dict of hal_stamp,mirror,tube,m,m_err,b,b_err arrays'''
+    points = self.get_HV_calib_points(mirrors)
+    # one group per (hal_stamp,mirror,tube)
+    unique,groups = numpy.unique(points['hal_stamp']*100000 + points['mirror'].astype(numpy.int64)*1000 + points['tube'],return_inverse=True)
+    keys = [(key_hal_stamp(key/100000),int(key/1000%100),int(key%1000)) for key in unique]
+    x,y = points['measured volts'],points['supplied volts']
+    m,m_err,b,b_err = fit_lines(groups,x,y,intercept=(fit == '2par'))
+    if arrays:
+      pars = {'hal_stamp':[key[0] for key in keys],'mirror':numpy.array([key[1] for key in keys]),'tube':numpy.array([key[2] for key in keys])}
+      pars.update(m=m,m_err=m_err)
+      if fit == '2par' : pars.update(b=b,b_err=b_err)
+      return pars
     HV_calib_pars = {}
-    for hal_stamp in HV_calib:
-      HV_calib_pars[hal_stamp] = {}
-      for mirror in HV_calib[hal_stamp]:
+    for k,(hal_stamp,mirror,tube) in enumerate(keys):
+      if not hal_stamp in HV_calib_pars:
+        HV_calib_pars[hal_stamp] = {}
+      if not mirror in HV_calib_pars[hal_stamp]:
         HV_calib_pars[hal_stamp][mirror] = {}
-        for tube in HV_calib[hal_stamp][mirror]:
-          x = HV_calib[hal_stamp][mirror][tube]['measured volts']
-          y = HV_calib[hal_stamp][mirror][tube]['supplied volts']
-          if fit == '1par':
-            fitfunc = lambda p,x : p[0]*x
-            errfunc = lambda p,x,y : fitfunc(p,x) - y
-            p0 = [1.] # parameter initial values
-            p1,covariance,details,mesg,success = optimize.leastsq(errfunc,p0,args=(x,y),full_output=True)
-            HV_calib_pars[hal_stamp][mirror][tube] = {'m':p1[0],'m_err':covariance[0][0]}
-          elif fit == '2par':
-            fitfunc = lambda p,x : p[1]*x + p[0]
-            errfunc = lambda p,x,y : fitfunc(p,x) - y
-            p0 = [0.,1]
-            p1,covariance,details,mesg,success = optimize.leastsq(errfunc,p0,args=(x,y),full_output=True)
-            HV_calib_pars[hal_stamp][mirror][tube] = {'m':p1[1],'m_err':covariance[1][1],'b':p1[0],'b_err':covariance[0][0]}
+      if fit == '1par':
+        HV_calib_pars[hal_stamp][mirror][tube] = {'m':m[k],'m_err':m_err[k]}
+      elif fit == '2par':
+        HV_calib_pars[hal_stamp][mirror][tube] = {'m':m[k],'m_err':m_err[k],'b':b[k],'b_err':b_err[k]}
     return HV_calib_pars
 
   def plot_HV_calib_pars(self):
@@ -182,26 +354,13 @@ class HVCalib(Plot):
   def plot_HV_calib_tubes(self):
     HV_calib_pars = self.get_HV_calib_pars()
     for mirror in HV_calib_pars:
-      raw_volts = {}
-      for hal_stamp in sorted(self.data['led355'].keys()):
-        volts_branch = self.data['led355'][hal_stamp]['volts']
-        volts = THPKT1_DST_VOLTS()
-        volts_branch.SetAddress(AddressOf(volts))
-        for entry in xrange(volts_branch.GetEntries()):
-          volts_branch.GetEntry(entry)
-          if not mirror == volts.pktHdr_crate : continue
-          for tube in xrange(volts.hvChnls):
-            if not tube in raw_volts:
-              raw_volts[tube] = []
-            raw_volts[tube].append(volts.hv[tube])
-      for tube in raw_volts:
-        mean = float(sum(raw_volts[tube]))/len(raw_volts[tube])
+      summary = self.get_HV_summary(mirror=mirror)
+      for tube in numpy.unique(summary['tube']):
+        parts = summary[summary['tube'] == tube]
+        # each part's mean volts, weighted by its number of packets
         hist = TH1F('m%02dt%03d' % (mirror,tube),';m%02dt%03d volts [V]' % (mirror,tube),1600,700,1500)
-        vals = []
-        for val in raw_volts[tube]:
-          hist.Fill(val)
-          vals.append(val)
-        print mirror,tube,vals,float(sum(raw_volts[tube]))/len(raw_volts[tube])
+        fill_arrays(hist,parts['sum']/parts['n'],w=parts['n'])
+        print mirror,tube,parts['min'].min(),parts['max'].max(),parts['sum'].sum()/parts['n'].sum()
         self.display_histogram(hist)
 
   def plot_calibrated_HV(self):
@@ -211,26 +370,20 @@ class HVCalib(Plot):
     self.canvas.Print('%s[' % plot_file)
     for hal_stamp in HV_calib_pars:
       for mirror in HV_calib_pars[hal_stamp]:
-        HV = {}
-        for hal_stamp in sorted(self.data['led355'].keys()):
-          volts_branch = self.data['led355'][hal_stamp]['volts']
-          volts = THPKT1_DST_VOLTS()
-          volts_branch.SetAddress(AddressOf(volts))
-          for entry in xrange(volts_branch.GetEntries()):
-            volts_branch.GetEntry(entry)
-            if not mirror == volts.pktHdr_crate : continue
-            for tube in xrange(volts.hvChnls):
-              if not tube in HV:
-                HV[tube] = []
-              #voltage = volts.hv[tube] + random() - self.volts_ped
-              voltage = HV_calib_pars[hal_stamp][mirror][tube]['m']*(volts.hv[tube] + random() - self.volts_ped)
-              HV[tube].append(voltage)
+        # sums of the calibrated volts of each tube over the parts:  the mean
+        # of m(hv + random() - ped) over a part is m(sum/n + 0.5 - ped)
+        HV,n = {},{}
+        for record in self.get_HV_summary(mirror=mirror):
+          tube = int(record['tube'])
+          m = HV_calib_pars[key_hal_stamp(record['hal_stamp'])][mirror][tube]['m']
+          HV[tube] = HV.get(tube,0) + m*(record['sum'] + record['n']*(0.5 - self.volts_ped))
+          n[tube] = n.get(tube,0) + record['n']
         name = 'm%02d volts' % mirror
         title = ';m%02d pegs;m%02d volts [V]' % (mirror,mirror)
         hvcalib_hist = TH2F(name,title,*(self.peg_bins + self.volts_bins))
         hvcalib_hist.SetMarkerStyle(2)
         for tube in HV:
-          mean = float(sum(HV[tube]))/len(HV[tube])
+          mean = HV[tube]/n[tube]
           hvcalib_hist.Fill(HV_pegs[mirror][tube],mean)
         hvcalib_hist.Fit('pol1','Q')
         self.display_histogram(hvcalib_hist,stat_style='nrme')
@@ -238,81 +391,75 @@ class HVCalib(Plot):
     self.canvas.Print('%s]' % plot_file)
     self.convert_plot_file(plot_file)
 
-  def plot_HV_supply_vs_time(self):
-    HV_supply_hists = {}
+  def fill_volts_vs_time(self,hists):
+    '''fill every requested volts vs time histogram in one pass over the led355
+    volts packets.  hists maps ('hv',mirror,tube), ('subcluster',mirror,sub),
+    ('subtube',mirror,sub) and ('supply',mirror) to TH2s'''
+    kinds = set(key[0] for key in hists)
     for hal_stamp in sorted(self.data['led355'].keys()):
       start = self.get_run_start(hal_stamp,'led355')
-      volts_branch = self.data['led355'][hal_stamp]['volts']
-      volts = THPKT1_DST_VOLTS()
-      volts_branch.SetAddress(AddressOf(volts))
-      for entry in xrange(volts_branch.GetEntries()):
-        volts_branch.GetEntry(entry)
-        time_diff = (start + 60*1000*volts.minute)/1000. - self.t0
-        mirror = volts.pktHdr_crate
-        if not mirror in HV_supply_hists:
-          HV_supply_hists[mirror] = TH2F('m%02d supply volts' % mirror,';time (LED runs);m%02d garb HV supply (lemo1) [V]' % mirror,*(self.time_bins + (2048,1200,1500)))
-        HV_supply_hists[mirror].Fill(time_diff,volts.garb_lemo1 + random())
-    self.write_plots('/home/findlay/data/plots/HV/HV_supply_volts.ps',HV_supply_hists.values(),xaxis_time=True,convert_file=True)
+      volts_packets = self.get_packets(hal_stamp,'led355','volts')
+      if len(volts_packets) == 0 : continue
+      mirrors = volts_packets['pktHdr_crate']
+      time_diffs = (start + 60*1000*volts_packets['minute'].astype(numpy.int64))/1000. - self.t0
+      if 'supply' in kinds:
+        supply = volts_packets['garb_lemo1'] + numpy.random.random_sample(len(volts_packets))
+        for mirror in numpy.unique(mirrors):
+          if not ('supply',mirror) in hists : continue
+          selected = mirrors == mirror
+          fill_arrays(hists[('supply',mirror)],time_diffs[selected],supply[selected])
+      if not kinds & set(('hv','subcluster','subtube')) : continue
+      # one value per channel of each packet
+      entries = volts_packets.entries()
+      tubes = numpy.arange(len(entries)) - volts_packets.offsets[entries]
+      hv = volts_packets['hv'] + numpy.random.random_sample(len(entries))
+      x,channel_mirrors = time_diffs[entries],mirrors[entries]
+      for kind,subs in (('hv',tubes),('subcluster',tubes/16 + 1),('subtube',tubes%16 + 1)):
+        if not kind in kinds : continue
+        # group the channels by (mirror,sub) and fill each requested group
+        keys = channel_mirrors.astype(numpy.int64)*self.tubes + subs
+        order = numpy.argsort(keys,kind='mergesort')
+        unique,first = numpy.unique(keys[order],return_index=True)
+        for key,group in izip(unique,numpy.split(order,first[1:])):
+          hist = hists.get((kind,int(key/self.tubes),int(key%self.tubes)))
+          if hist is not None : fill_arrays(hist,x[group],hv[group])
+
+  def plot_HV_supply_vs_time(self):
+    HV_supply_hists = {}
+    for mirror in xrange(1,self.mirrors + 1):
+      HV_supply_hists[('supply',mirror)] = TH2F('m%02d supply volts' % mirror,';time (LED runs);m%02d garb HV supply (lemo1) [V]' % mirror,*(self.time_bins + (2048,1200,1500)))
+    self.fill_volts_vs_time(HV_supply_hists)
+    HV_supply_hists = [h for h in HV_supply_hists.values() if h.GetEntries() > 0]
+    self.write_plots('/home/findlay/data/plots/HV/HV_supply_volts.ps',HV_supply_hists,xaxis_time=True,convert_file=True)
 
   def plot_HV_vs_time(self):
     plot_file = '/home/findlay/data/plots/HV/HV_vs_time.ps'
-    self.canvas.Print('%s[' % plot_file)
+    hists = {}
     for mirror in xrange(1,self.mirrors + 1):
       if not mirror == 1 : continue
       for tube in xrange(self.tubes):
-        h = TH2F('m%02dt%03d supply volts' % (mirror,tube),';time (LED runs);m%02dt%03d HV [V]' % (mirror,tube),*(self.time_bins + (2048,512,2048)))
-        for hal_stamp in sorted(self.data['led355'].keys()):
-          start = self.get_run_start(hal_stamp,'led355')
-          volts_branch = self.data['led355'][hal_stamp]['volts']
-          volts = THPKT1_DST_VOLTS()
-          volts_branch.SetAddress(AddressOf(volts))
-          for entry in xrange(volts_branch.GetEntries()):
-            volts_branch.GetEntry(entry)
-            if not volts.pktHdr_crate == mirror : continue
-            time_diff = (start + 60*1000*volts.minute)/1000. - self.t0
-            h.Fill(time_diff,volts.hv[tube] + random())
-        self.display_histogram(h,xaxis_time=True)
-        self.write_plot(plot_file,h,xaxis_time=True)
+        hists[('hv',mirror,tube)] = TH2F('m%02dt%03d supply volts' % (mirror,tube),';time (LED runs);m%02dt%03d HV [V]' % (mirror,tube),*(self.time_bins + (2048,512,2048)))
+    self.fill_volts_vs_time(hists)
+    self.canvas.Print('%s[' % plot_file)
+    for key in sorted(hists.keys()):
+      self.display_histogram(hists[key],xaxis_time=True)
+      self.write_plot(plot_file,hists[key],xaxis_time=True)
     self.canvas.Print('%s]' % plot_file)
     self.convert_plot_file(plot_file)
 
   def plot_HV_supply_vs_time(self):
     HV_supply_hists = {}
     for mirror in xrange(1,self.mirrors + 1):
-      HV_supply_hists[mirror] = TH2F('m%02d HV supply volts' % mirror,';time (LED runs);m%02d HV [V]' % mirror,*(self.time_bins + (2048,512,2048)))
-      for hal_stamp in sorted(self.data['led355'].keys()):
-        start = self.get_run_start(hal_stamp,'led355')
-        volts_branch = self.data['led355'][hal_stamp]['volts']
-        volts = THPKT1_DST_VOLTS()
-        volts_branch.SetAddress(AddressOf(volts))
-        for entry in xrange(volts_branch.GetEntries()):
-          volts_branch.GetEntry(entry)
-          if not volts.pktHdr_crate == mirror : continue
-          time_diff = (start + 60*1000*volts.minute)/1000. - self.t0
-          HV_supply_hists[mirror].Fill(time_diff,volts.garb_lemo1 + random())
-    self.write_plots('/home/findlay/data/plots/HV/HV_supply_vs_time.ps',HV_supply_hists.values(),xaxis_time=True)
+      HV_supply_hists[('supply',mirror)] = TH2F('m%02d HV supply volts' % mirror,';time (LED runs);m%02d HV [V]' % mirror,*(self.time_bins + (2048,512,2048)))
+    self.fill_volts_vs_time(HV_supply_hists)
+    self.write_plots('/home/findlay/data/plots/HV/HV_supply_vs_time.ps',[HV_supply_hists[key] for key in sorted(HV_supply_hists.keys())],xaxis_time=True)
 
   def plot_HV_sub_vs_time(self,sub_type='subcluster'):
     HV_sub_hists = {}
     for sub in xrange(1,17):
-      HV_sub_hists[sub] = TH2F('m06 subcl %d HV' % sub,';time (LED runs);%s %d HV [V]' % (sub_type,sub),*(self.time_bins + (2048,512,2048)))
-      for hal_stamp in sorted(self.data['led355'].keys()):
-        start = self.get_run_start(hal_stamp,'led355')
-        volts_branch = self.data['led355'][hal_stamp]['volts']
-        volts = THPKT1_DST_VOLTS()
-        volts_branch.SetAddress(AddressOf(volts))
-        for entry in xrange(volts_branch.GetEntries()):
-          volts_branch.GetEntry(entry)
-          if not volts.pktHdr_crate == 6 : continue
-          time_diff = (start + 60*1000*volts.minute)/1000. - self.t0
-          for tube in xrange(self.tubes):
-            if sub_type == 'subcluster':
-              if tube/16 + 1 == sub:
-                HV_sub_hists[sub].Fill(time_diff,volts.hv[tube] + random())
-            if sub_type == 'subtube':
-              if tube%16 + 1 == sub:
-                HV_sub_hists[sub].Fill(time_diff,volts.hv[tube] + random())
-    self.write_plots('/home/findlay/data/plots/HV/HV_%s_vs_time.ps' % sub_type,HV_sub_hists.values(),xaxis_time=True)
+      HV_sub_hists[(sub_type,6,sub)] = TH2F('m06 subcl %d HV' % sub,';time (LED runs);%s %d HV [V]' % (sub_type,sub),*(self.time_bins + (2048,512,2048)))
+    self.fill_volts_vs_time(HV_sub_hists)
+    self.write_plots('/home/findlay/data/plots/HV/HV_%s_vs_time.ps' % sub_type,[HV_sub_hists[key] for key in sorted(HV_sub_hists.keys())],xaxis_time=True)
 
   def plot_m06_20090821_HV_calib(self):
     hal_stamps = sorted(self.data['hvcalib'].keys())
@@ -320,11 +467,8 @@ class HVCalib(Plot):
       if not re.search(r'y2009m08d21',hal_stamp) : continue
       mirror = 6
       step_voltages = self.get_HV_calib_steps(hal_stamp)
-      volts_branch = self.data['hvcalib'][hal_stamp]['volts']
-      volts = THPKT1_DST_VOLTS()
-      volts_branch.SetAddress(AddressOf(volts))
-      for entry in xrange(volts_branch.GetEntries()):
-        volts_branch.GetEntry(entry)
+      volts_packets = self.get_packets(hal_stamp,'hvcalib','volts')
+      for volts in volts_packets:
         if not volts.pktHdr_crate == mirror : continue
         for tube in xrange(volts.hvChnls):
           if not tube in raw_volts:
@@ -338,12 +482,9 @@ class LEDFlashes(Plot):
     for mirror in xrange(1,self.mirrors + 1):
       for tube in xrange(self.tubes):
         for hal_stamp in sorted(self.data['led355'].keys()):
-          event_branch = self.data['led355'][hal_stamp]['event']
-          event = THPKT1_DST_EVENT()
-          event_branch.SetAddress(AddressOf(event))
+          event_packets = self.get_packets(hal_stamp,'led355','event')
           h = TProfile('%sm%02dt%03d QDCB' % (hal_stamp,mirror,tube),';event;%sm%02dt%03d QDCB' % (hal_stamp,mirror,tube),*(512,0,512))
-          for entry in xrange(event_branch.GetEntries()):
-            event_branch.GetEntry(entry)
+          for event in event_packets:
             if mirror != event.pktHdr_crate : continue
             if tube in event.tube_num:
               h.Fill(event.event,event.qdcB[tube])
@@ -351,39 +492,40 @@ class LEDFlashes(Plot):
 #              h.Fit('pol0','QA')
           self.display_histogram(h)
 
+  def event_time_index(self,hal_stamp):
+    '''(keys,entries):  the event packets of a part sorted by mirror and event
+    time (start + 60000*minute + msec), as keys time*32 + mirror, with their
+    entry numbers'''
+    start = self.get_run_start(hal_stamp,'led355')
+    event_packets = self.get_packets(hal_stamp,'led355','event')
+    keys = (start + 60*1000*event_packets['minute'].astype(numpy.int64) + event_packets['msec'])*32 + event_packets['pktHdr_crate']
+    entries = numpy.argsort(keys,kind='mergesort')
+    return keys[entries],entries
+
   def observe_low_flashes(self):
     flash_times = {}
     for hal_stamp in sorted(self.data['led355'].keys()):
       flash_times[hal_stamp] = {}
-      start = self.get_run_start(hal_stamp,'led355')
-      time_branch = self.data['led355'][hal_stamp]['time']
-      time = THPKT1_DST_TIME()
-      time_branch.SetAddress(AddressOf(time))
-      event_branch = self.data['led355'][hal_stamp]['event']
-      event = THPKT1_DST_EVENT()
-      event_branch.SetAddress(AddressOf(event))
-      for entry in xrange(time_branch.GetEntries()):
-        time_branch.GetEntry(entry)
-        # get corresponding event for this tevent
-        last_event_entry = 0
-        for tevent in xrange(time.events):
-          for event_entry in xrange(last_event_entry,event_branch.GetEntries()):
-            event_branch.GetEntry(event_entry)
-#            print start + 60*1000*event.minute + event.msec - convert_time(time,tevent),entry,event_entry,event.event ; raw_input()
-            if start + 60*1000*event.minute + event.msec == convert_time(time,tevent):
-              last_event_entry = event_entry
-              break
-          mirror = time.mirror[tevent]
-          if not mirror in flash_times[hal_stamp]:
-            flash_times[hal_stamp][mirror] = {'mean':0,'entries':[]}
-          flash_times[hal_stamp][mirror]['entries'].append(time.nsec[tevent]%5e7)
-        flash_times[hal_stamp][mirror]['mean'] = mean([t%5e7 for t in time.nsec[tevent]])
-      print '%s  %5d' % (hal_stamp,time_branch.GetEntries())
+      time_packets = self.get_packets(hal_stamp,'led355','time')
+      tevent_times = packet_times(time_packets)
+      mirrors = time_packets['mirror']
+      nsecs = time_packets['nsec']%5e7
+      # get corresponding event for each tevent
+      keys,entries = self.event_time_index(hal_stamp)
+      tevent_keys = tevent_times.astype(numpy.int64)*32 + mirrors
+      found = numpy.searchsorted(keys,tevent_keys)
+      matched = found < len(keys)
+      matched[matched] = keys[found[matched]] == tevent_keys[matched]
+      events = -numpy.ones(len(tevent_keys),dtype=numpy.int64) # event entry of each tevent
+      events[matched] = entries[found[matched]]
+      for mirror in numpy.unique(mirrors):
+        selected = mirrors == mirror
+        flash_times[hal_stamp][mirror] = {'mean':nsecs[selected].mean(),'entries':nsecs[selected],'events':events[selected]}
+      print '%s  %5d  %5d' % (hal_stamp,len(time_packets),matched.sum())
     flash_hist = TH1F('combined detector nsecs',';nanoseconds%5e7 (normalized to 50 ms) [s];events',10000,0,1e8)
     for part in flash_times.values():
       for mirror in part.keys():
-        for entry in part[mirror]['entries']:
-          flash_hist.Fill(entry + (5e7 - part[mirror]['mean'])) # normalize all data means to 5e7
+        fill_arrays(flash_hist,part[mirror]['entries'] + (5e7 - part[mirror]['mean'])) # normalize all data means to 5e7
     self.canvas.cd()
     self.canvas.SetLogy()
     self.write_plot('/home/findlay/data/plots/LED/LED_resonance.ps',flash_hist,xaxis_time=False)
@@ -392,11 +534,8 @@ class LEDFlashes(Plot):
     flash_hists = {}
     for hal_stamp in self.data['led355'].keys():
       start = self.get_run_start(hal_stamp,'led355')
-      event_branch = self.data['led355'][hal_stamp]['event']
-      event = THPKT1_DST_EVENT()
-      event_branch.SetAddress(AddressOf(event))
-      for entry in xrange(event_branch.GetEntries()):
-        event_branch.GetEntry(entry)
+      event_packets = self.get_packets(hal_stamp,'led355','event')
+      for entry,event in enumerate(event_packets):
         h = TH1I('%sm%de%f' % (hal_stamp,event.pktHdr_crate,entry),';QDCB;tubes',*(compute_bins(event.qdcB)))
         for qdcB in event.qdcB : h.Fill(qdcB + random())
         h.Fit('gaus','LL Q')
@@ -404,145 +543,137 @@ class LEDFlashes(Plot):
           if not event.pktHdr_crate in flash_hists:
             flash_hists[event.pktHdr_crate] = h
         if len(flash_hists) == 14 : break
-      print '%s  %5d' % (hal_stamp,event_branch.GetEntries())
+      print '%s  %5d' % (hal_stamp,len(event_packets))
     self.write_plots('/home/findlay/data/plots/LED/LED_flashes.ps',flash_hists.values(),xaxis_time=False)
 
   def plot_thresholds(self):
     threshold_hists = {}
     for hal_stamp in self.data['led355'].keys():
       start = self.get_run_start(hal_stamp,'led355')
-      threshold_branch = self.data['led355'][hal_stamp]['threshold']
-      threshold = THPKT1_DST_THRESHOLD()
-      threshold_branch.SetAddress(AddressOf(threshold))
-      for entry in xrange(threshold_branch.GetEntries()):
-        threshold_branch.GetEntry(entry)
-        mirror = threshold.pktHdr_crate
-        h = TH1I('%sm%de%d' % (hal_stamp,mirror,entry),';threshold;tubes',*(compute_bins(threshold.thB)))
-        for thB in threshold.thB : h.Fill(thB + random())
-        h.Fit('gaus','LL Q')
-        self.adj_stats_box(h,self.canvas)
-        h.Draw()
-        self.canvas.Modified() ; self.canvas.Update()
-        raw_input()
-        if not mirror in threshold_hists:
-          threshold_hists[mirror] = TH2F('m%02d thresholds' % mirror,';time [200[8|9]-mm-dd];m%02d mean thB' % mirror,*(self.time_bins + (1000,0,1000)))
-        time_diff = (start + 60*1000*threshold.min)/1000. - self.t0
-        threshold_hists[mirror].Fill(time_diff,h.GetMean())
+      entry = 0
+      for threshold_packets in self.data_object.iter_packets('led355',hal_stamp,'threshold'):
+        for threshold in threshold_packets:
+          mirror = threshold.pktHdr_crate
+          h = TH1I('%sm%de%d' % (hal_stamp,mirror,entry),';threshold;tubes',*(compute_bins(threshold.thB)))
+          entry += 1
+          for thB in threshold.thB : h.Fill(thB + random())
+          h.Fit('gaus','LL Q')
+          self.adj_stats_box(h,self.canvas)
+          h.Draw()
+          self.canvas.Modified() ; self.canvas.Update()
+          raw_input()
+          if not mirror in threshold_hists:
+            threshold_hists[mirror] = TH2F('m%02d thresholds' % mirror,';time [200[8|9]-mm-dd];m%02d mean thB' % mirror,*(self.time_bins + (1000,0,1000)))
+          time_diff = (start + 60*1000*threshold.min)/1000. - self.t0
+          threshold_hists[mirror].Fill(time_diff,h.GetMean())
     self.write_plots('/home/findlay/data/plots/LED/LED_thresholds.ps',threshold_hists.values(),xaxis_time=True)
 
-  def compute_flash_stats_cluster(self,flash_stats_cluster_file,hal_stamps,i):
-    for hal_stamp in hal_stamps:
-      start = self.get_run_start(hal_stamp,'led355')
-      event_branch = self.data['led355'][hal_stamp]['event']
-      event = THPKT1_DST_EVENT()
-      event_branch.SetAddress(AddressOf(event))
-      for entry in xrange(event_branch.GetEntries()):
-        event_branch.GetEntry(entry) # root copies each object into 'event'
-        h = TH1I('%sm%02d %d' % (hal_stamp,event.pktHdr_crate,i),';QDCB;tubes',*(compute_bins(event.qdcB)))
-        # QDC truncates value to integer.  This spreads out the data randomly
-        # throughout the interval like it originally was
-        for qdcB in event.qdcB : h.Fill(qdcB + random())
-        #h.Fit('gaus','E I LL M Q')
-        h.Fit('gaus','LL Q')
-        gaus = h.GetListOfFunctions().FindObject('gaus')
-        hents,hmean,hRMS = h.GetEntries(),h.GetMean(),h.GetRMS()
-        const,mean,sigma = gaus.GetParameter(0),gaus.GetParameter(1),gaus.GetParameter(2)
-        # event time is measured as offset from first RUN START in milliseconds
-        t = start + 60*1000*event.minute + event.msec
-        flash_stats_cluster_file.write('%d %sm%02d %d %d %f %f %f %f %f\n' % (i,hal_stamp,event.pktHdr_crate,t,hents,hmean,hRMS,const,mean,sigma))
-        i += 1
-      print '%s  %5d' % (hal_stamp,event_branch.GetEntries())
-
-  def compute_flash_stats_tube(self,flash_stats_file,hal_stamps,i):
-    for hal_stamp in hal_stamps:
-      events = {}
-      start = self.get_run_start(hal_stamp,'led355')
-      event_branch = self.data['led355'][hal_stamp]['event']
-      event = THPKT1_DST_EVENT()
-      event_branch.SetAddress(AddressOf(event))
-      for entry in xrange(event_branch.GetEntries()):
-        event_branch.GetEntry(entry)
-        mirror = event.pktHdr_crate
-        for i in xrange(event.ntubes):
-          tube = event.tube_num[i]
-          if not mirror in events:
-            events[mirror] = {}
-          if not tube in events[mirror]:
-            events[mirror][tube] = []
-          events[mirror][tube].append((event.qdcB[i],start + 60*1000*event.minute + event.msec))
-      for mirror in events:
-        for tube in events[mirror]:
-          h = TH1I('%d' % i,';QDCB;events',*(compute_bins(events[mirror][tube][0])))
-          times = []
-          for QDCB,time_stamp in events[mirror][tube]:
-            h.Fill(QDCB + random())
-            times.append(time_stamp)
-          h.Fit('gaus','LL Q')
-          gaus = h.GetListOfFunctions().FindObject('gaus')
-          hents,hmean,hRMS = h.GetEntries(),h.GetMean(),h.GetRMS()
-          const,mean,sigma = gaus.GetParameter(0),gaus.GetParameter(1),gaus.GetParameter(2)
-          t = sum(times)/len(times) # average timestamp
-          flash_stats_file.write('%d %sm%02dt%03d %d %d %f %f %f %f %f\n' % (i,hal_stamp,mirror,tube,t,hents,hmean,hRMS,const,mean,sigma))
-          i += 1
-      print '%s  %5d' % (hal_stamp,event_branch.GetEntries())
-
-  def make_flash_stats(self,cluster_file,tube_file):
+  def compute_flash_stats(self,flash_stats,stats,hal_stamps,i,processes=1,validate=0):
+    '''compute the cluster or tube flash stats of each part, in a pool of
+    worker processes when processes > 1, and append them in hal stamp order,
+    numbering the records on from i.  validate > 0 checks that many fits of
+    each part against ROOT'''
+    jobs = [(stats,str(hal_stamp),self.data_object.files['led355'][hal_stamp],self.get_run_start(hal_stamp,'led355'),validate) for hal_stamp in hal_stamps]
+    append_flash_stats(flash_stats,jobs,i,processes)
+
+  def compute_flash_stats_cluster(self,flash_stats_cluster,hal_stamps,i,processes=1,validate=0):
+    self.compute_flash_stats(flash_stats_cluster,'cluster',hal_stamps,i,processes,validate)
+
+  def compute_flash_stats_tube(self,flash_stats_tube,hal_stamps,i,processes=1,validate=0):
+    self.compute_flash_stats(flash_stats_tube,'tube',hal_stamps,i,processes,validate)
+
+  def make_flash_stats(self,cluster_file,tube_file,reprocess=(),processes=1,validate=0):
+    '''compute flash stats for the parts not yet journaled in each store, and
+    again for the hal stamps in reprocess, spreading the parts over processes
+    worker processes.  validate > 0 refits that many random histograms of
+    each part with ROOT and prints the differences'''
+    reprocess = [hal_stamp_key(hal_stamp) for hal_stamp in reprocess]
     for file_name in (cluster_file,tube_file):
-      if not os.path.isfile(file_name): # new file
-        if not os.path.isdir(os.path.split(file_name)[0]):
-          os.makedirs(os.path.split(file_name)[0])
-        i = 0
-        hal_stamps = sorted(self.data['led355'].keys())
-      else: # append to existing file
-        zcat = Popen(('/bin/zcat',file_name),stdout=PIPE)
-        tail = Popen(('/usr/bin/tail','-n','1'),stdin=zcat.stdout,stdout=PIPE)
-        #line = re.split('\n',tail.stdout.read())[0]
-        line = tail.stdout.read()
-        zcat.stdout.close() ; tail.stdout.close()
-        if file_name == cluster_file : groups = re.match(self.flash_stats_cluster_regex,line).groups()
-        elif file_name == tube_file : groups = re.match(self.flash_stats_tube_regex,line).groups()
-        i,hal_stamp = int(groups[0]) + 1,HalStamp(groups[1])
-        sorted_hal_stamps = sorted(self.data['led355'].keys())
-        hal_stamps = sorted_hal_stamps[sorted_hal_stamps.index(hal_stamp) + 1:]
-      flash_stats_file = gzip.open(file_name,'a+',9)
-      if file_name == cluster_file : self.compute_flash_stats_cluster(flash_stats_file,hal_stamps,i)
-      elif file_name == tube_file : self.compute_flash_stats_tube(flash_stats_file,hal_stamps,i)
-      flash_stats_file.close()
+      flash_stats = RecordStore(file_name,flash_stats_dtype,('mirror','tube','hal_stamp'))
+      try:
+        flash_stats.lock()
+        flash_stats.recover()
+        done = flash_stats.parts()
+        last = flash_stats.last()
+        if last is None : i = 0 # new store
+        else : i = int(last['i']) + 1 # append to existing store
+        hal_stamps = [hal_stamp for hal_stamp in sorted(self.data['led355'].keys()) if not hal_stamp_key(hal_stamp) in done or hal_stamp_key(hal_stamp) in reprocess]
+        if file_name == cluster_file : self.compute_flash_stats_cluster(flash_stats,hal_stamps,i,processes,validate)
+        elif file_name == tube_file : self.compute_flash_stats_tube(flash_stats,hal_stamps,i,processes,validate)
+      finally:
+        flash_stats.unlock()
 
 class LEDEnv(Plot):
   '''plot LED flash mean,stddev,etc. versus various environmental parameters'''
 
+  def __init__(self):
+    Plot.__init__(self)
+    self.session_inputs = None
+    self.session_plots = []
+
+  def register_plots(self,*plots):
+    '''add plot methods, by name, to the next run_plots session'''
+    for plot in plots:
+      if not plot in self.session_plots : self.session_plots.append(plot)
+
+  def run_plots(self,plots=None):
+    '''run the registered plot methods (or plots) as one session, in which
+    each input they share (flash stats, notice series, HV summary) is read
+    once for all of them'''
+    self.session_inputs = {}
+    try:
+      for plot in plots or self.session_plots:
+        getattr(self,plot)()
+    finally:
+      self.session_inputs = None
+    self.session_plots = []
+
+  def session_input(self,key,load):
+    '''load(), kept for the rest of a run_plots session'''
+    if self.session_inputs is None : return load()
+    if not key in self.session_inputs:
+      self.session_inputs[key] = load()
+    return self.session_inputs[key]
+
+  def get_LED_temps(self,**values):
+    return self.session_input(('LED_temps',) + tuple(sorted(values.items())),lambda : Plot.get_LED_temps(self,**values))
+
+  def get_PTH(self,**values):
+    return self.session_input(('PTH',) + tuple(sorted(values.items())),lambda : Plot.get_PTH(self,**values))
+
+  def get_HV_summary(self,**values):
+    return self.session_input(('HV_summary',) + tuple(sorted(values.items())),lambda : Plot.get_HV_summary(self,**values))
+
   def get_flash_stats_cluster(self):
+    return self.session_input(('flash_stats_cluster',),self.load_flash_stats_cluster)
+
+  def load_flash_stats_cluster(self):
     stat_tuples = {}
-    for line in self.flash_stats_cluster_file:
-      match = re.match(self.flash_stats_cluster_regex,line).groups()
-      i,hal_stamp,mirror,t = int(match[0]),match[1],int(match[2]),int(match[3])
-      hent,hmean,hRMS = int(match[4]),float(match[5]),float(match[6])
-      const,mean,sigma = float(match[7]),float(match[8]),float(match[9])
-      if not mirror in stat_tuples:
-        stat_tuples[mirror] = []
-      stat_tuples[mirror].append((t,hent,hmean,hRMS,const,mean,sigma))
+    records = self.flash_stats_cluster.load()
+    for mirror in numpy.unique(records['mirror']):
+      selected = self.flash_stats_cluster.select(mirror=mirror)
+      stat_tuples[int(mirror)] = zip(*[selected[field].tolist() for field in ('t','hents','hmean','hRMS','const','mean','sigma')])
     return stat_tuples
 
-  def get_flash_stats_tube(self):
+  def get_flash_stats_tube(self,mirror=None):
+    return self.session_input(('flash_stats_tube',mirror),lambda : self.load_flash_stats_tube(mirror))
+
+  def load_flash_stats_tube(self,mirror=None):
     stat_tuples = {}
-    ext_hs_regex = re.compile(r'(y\d{4}m\d{2}d\d{2}p\d{2})m(\d{2})t(\d{3})')
-    for line in csv.reader(self.flash_stats_tube_file,delimiter=' '):
-      i = int(line[0])
-      groups = re.match(ext_hs_regex,line[1]).groups()
-      hal_stamp,mirror,tube = groups[0],int(groups[1]),int(groups[2])
-      t = int(line[2])
-      hent,hmean,hRMS = int(line[3]),float(line[4]),float(line[5])
-      const,mean,sigma = float(line[6]),float(line[7]),float(line[8])
+    if mirror == None : records = self.flash_stats_tube.load()
+    else : records = self.flash_stats_tube.select(mirror=mirror)
+    hal_stamps = dict((key,key_hal_stamp(key)) for key in numpy.unique(records['hal_stamp']))
+    columns = [records[field].tolist() for field in ('mirror','tube','hal_stamp','t','hents','hmean','hRMS','const','mean','sigma')]
+    for mirror,tube,hal_stamp,t,hent,hmean,hRMS,const,mean,sigma in zip(*columns):
       if not mirror in stat_tuples:
         stat_tuples[mirror] = {}
       if not tube in stat_tuples[mirror]:
         stat_tuples[mirror][tube] = {}
-      stat_tuples[mirror][tube][hal_stamp] = (t,hent,hmean,hRMS,const,mean,sigma)
+      stat_tuples[mirror][tube][hal_stamps[hal_stamp]] = (t,hent,hmean,hRMS,const,mean,sigma)
     return stat_tuples
 
   def plot_QDCB_tube_vs_time(self):
-    flash_stats = self.get_flash_stats_tube()
+    flash_stats = self.get_flash_stats_tube(6)
     flash_hists = {}
     for mirror in flash_stats:
       if not mirror in flash_hists:
@@ -550,125 +681,97 @@ class LEDEnv(Plot):
       for tube in flash_stats[mirror]:
         if not tube in flash_hists[mirror]:
           flash_hists[mirror][tube] = TH2F('m%02dt%03d' % (mirror,tube),';time;m%02dt%03d QDCB LED mean' % (mirror,tube),*(self.time_bins + self.mean_bins))
-        for entry in flash_stats[mirror][tube]:
+        for entry in flash_stats[mirror][tube].values():
           flash_hists[mirror][tube].Fill(entry[0]/1000. - self.t0,entry[2]) # hmean vs time
     self.write_plots('/home/findlay/data/plots/LED/QDCB_tube_vs_time_m06_t128-255.ps',flash_hists[6].values(),xaxis_time=True)
 
   def plot_LED_flash_stats(self):
     stats_hists = {}
-    for line in self.flash_stats_cluster_file:
-      match = re.match(self.flash_stats_cluster_regex,line).groups()
-      i,hal_stamp,mirror,t = int(match[0]),match[1],int(match[2]),int(match[3])
-      hent,hmean,hRMS = int(match[4]),float(match[5]),float(match[6])
-      const,mean,sigma = float(match[7]),float(match[8]),float(match[9])
-      if hent < 241 : continue
-      time_diff = t/1000. - self.t0
-      if not mirror in stats_hists:
-        hent_hist = TH2F('mirror %d LED flash tubes' % mirror,';time [200[8|9]-mm-dd];QDCB tubes',*(self.time_bins + self.hent_bins))
-        hmean_hist = TH2F('mirror %d LED flash hist mean' % mirror,';time [200[8|9]-mm-dd];QDCB hist mean',*(self.time_bins + self.mean_bins))
-        hRMS_hist = TH2F('mirror %d LED flash hist RMS' % mirror,';time [200[8|9]-mm-dd];QDCB hist RMS',*(self.time_bins + self.RMS_bins))
-        const_hist = TH2F('mirror %d LED flash constants' % mirror,';time [200[8|9]-mm-dd];QDCB normal constant',*(self.time_bins + self.const_bins))
-        mean_hist = TH2F('mirror %d LED flash means' % mirror,';time [200[8|9]-mm-dd];QDCB normal mean',*(self.time_bins + self.mean_bins))
-        sigma_hist = TH2F('mirror %d LED flash sigmas' % mirror,';time [200[8|9]-mm-dd];QDCB normal sigma',*(self.time_bins + self.RMS_bins))
-        stats_hists[mirror] = {'hent':hent_hist,'hmean':hmean_hist,'hRMS':hRMS_hist,'const':const_hist,'mean':mean_hist,'sigma':sigma_hist}
-      stats_hists[mirror]['hent'].Fill(time_diff,hent)
-      stats_hists[mirror]['hmean'].Fill(time_diff,hmean)
-      stats_hists[mirror]['hRMS'].Fill(time_diff,hRMS)
-      stats_hists[mirror]['const'].Fill(time_diff,const)
-      stats_hists[mirror]['mean'].Fill(time_diff,mean)
-      stats_hists[mirror]['sigma'].Fill(time_diff,sigma)
+    records = self.flash_stats_cluster.load()
+    records = records[records['hents'] >= 241]
+    for mirror in numpy.unique(records['mirror']):
+      selected = records[records['mirror'] == mirror]
+      time_diff = selected['t']/1000. - self.t0
+      hent_hist = TH2F('mirror %d LED flash tubes' % mirror,';time [200[8|9]-mm-dd];QDCB tubes',*(self.time_bins + self.hent_bins))
+      hmean_hist = TH2F('mirror %d LED flash hist mean' % mirror,';time [200[8|9]-mm-dd];QDCB hist mean',*(self.time_bins + self.mean_bins))
+      hRMS_hist = TH2F('mirror %d LED flash hist RMS' % mirror,';time [200[8|9]-mm-dd];QDCB hist RMS',*(self.time_bins + self.RMS_bins))
+      const_hist = TH2F('mirror %d LED flash constants' % mirror,';time [200[8|9]-mm-dd];QDCB normal constant',*(self.time_bins + self.const_bins))
+      mean_hist = TH2F('mirror %d LED flash means' % mirror,';time [200[8|9]-mm-dd];QDCB normal mean',*(self.time_bins + self.mean_bins))
+      sigma_hist = TH2F('mirror %d LED flash sigmas' % mirror,';time [200[8|9]-mm-dd];QDCB normal sigma',*(self.time_bins + self.RMS_bins))
+      stats_hists[mirror] = {'hent':hent_hist,'hmean':hmean_hist,'hRMS':hRMS_hist,'const':const_hist,'mean':mean_hist,'sigma':sigma_hist}
+      fill_arrays(stats_hists[mirror]['hent'],time_diff,selected['hents'])
+      fill_arrays(stats_hists[mirror]['hmean'],time_diff,selected['hmean'])
+      fill_arrays(stats_hists[mirror]['hRMS'],time_diff,selected['hRMS'])
+      fill_arrays(stats_hists[mirror]['const'],time_diff,selected['const'])
+      fill_arrays(stats_hists[mirror]['mean'],time_diff,selected['mean'])
+      fill_arrays(stats_hists[mirror]['sigma'],time_diff,selected['sigma'])
     self.write_kind_plots(stats_hists,'/home/findlay/data/plots/LED/LED_flash_%s.ps',xaxis_time=True)
 
   def plot_LED_temps(self):
     LED_temp_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      notice_branch = self.data['led355'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        if notice.type == 10:
-          try:
-            tA,tB,tC,tD = [float(temp) for temp in re.match(self.LED_temp_regex,notice.text).groups()]
-          except:
-            continue
-          mirror = notice.pktHdr_crate
-          time_diff = convert_time(notice)/1000. - self.t0
-          if not mirror in LED_temp_hists:
-            hist_A = TH2F('mirror %d LED temp A' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.LED_T_bins))
-            hist_B = TH2F('mirror %d LED temp B' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.LED_T_bins))
-            hist_C = TH2F('mirror %d LED temp C' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.LED_T_bins))
-            hist_D = TH2F('mirror %d LED temp D' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.T_bins))
-            LED_temp_hists[mirror] = {'A':hist_A,'B':hist_B,'C':hist_C,'D':hist_D}
-          LED_temp_hists[mirror]['A'].Fill(time_diff,tA)
-          LED_temp_hists[mirror]['B'].Fill(time_diff,tB)
-          LED_temp_hists[mirror]['C'].Fill(time_diff,tC)
-          LED_temp_hists[mirror]['D'].Fill(time_diff,tD)
+    LED_temps = self.get_LED_temps()
+    for mirror in numpy.unique(LED_temps['mirror']):
+      temps = LED_temps[LED_temps['mirror'] == mirror]
+      time_diffs = temps['t']/1000. - self.t0
+      hist_A = TH2F('mirror %d LED temp A' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.LED_T_bins))
+      hist_B = TH2F('mirror %d LED temp B' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.LED_T_bins))
+      hist_C = TH2F('mirror %d LED temp C' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.LED_T_bins))
+      hist_D = TH2F('mirror %d LED temp D' % mirror,';time [200[8|9]-mm-dd];temperature [K]',*(self.time_bins + self.T_bins))
+      LED_temp_hists[mirror] = {'A':hist_A,'B':hist_B,'C':hist_C,'D':hist_D}
+      for temp in ('A','B','C','D'):
+        fill_arrays(LED_temp_hists[mirror][temp],time_diffs,temps['t' + temp])
     self.write_kind_plots(LED_temp_hists,'/home/findlay/data/plots/LED/LED_temp_%s.ps',xaxis_time=True)
 
   def plot_temp_AB_average(self):
     average_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      notice_branch = self.data['led355'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        if notice.type == 10:
-          try:
-            tA,tB,tC,tD = [float(temp) for temp in re.match(self.LED_temp_regex,notice.text).groups()]
-          except:
-            continue
-          mirror = notice.pktHdr_crate
-          time_diff = convert_time(notice)/1000. - self.t0
-          if not mirror in average_hists:
-            average_hists[mirror] = TH2F('mirror %d temp A,B average' % mirror,';time [200[8|9]-mm-dd];temp (A + B)/2 [K]',*(self.time_bins + self.LED_T_bins))
-          average_hists[mirror].Fill(time_diff,(tA + tB)/2.)
+    LED_temps = self.get_LED_temps()
+    for mirror in numpy.unique(LED_temps['mirror']):
+      temps = LED_temps[LED_temps['mirror'] == mirror]
+      average_hists[mirror] = TH2F('mirror %d temp A,B average' % mirror,';time [200[8|9]-mm-dd];temp (A + B)/2 [K]',*(self.time_bins + self.LED_T_bins))
+      fill_arrays(average_hists[mirror],temps['t']/1000. - self.t0,(temps['tA'] + temps['tB'])/2.)
     self.write_plots('/home/findlay/data/plots/LED/LED_temp_AB_average.ps',average_hists.values(),xaxis_time=True)
 
   def plot_cluster_PTH(self):
     cluster_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      notice_branch = self.data['led355'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        if notice.type == 17:
-          try:
-            match = re.match(self.PTH_regex,notice.text).groups()
-            mirror,press,temp,hum = int(match[0]),float(match[1]),float(match[2]),float(match[3])
-          except:
-            continue
-          time_diff = convert_time(notice)/1000. - self.t0
-          if not mirror in cluster_hists:
-            P_hist = TH2F('mirror %d pressure' % mirror,';time [200[8|9]-mm-dd];cluster pressure [Pa]',*(self.time_bins + self.P_bins))
-            T_hist = TH2F('mirror %d temperature' % mirror,';time [200[8|9]-mm-dd];cluster temperature [K]',*(self.time_bins + self.T_bins))
-            H_hist = TH2F('mirror %d humidity' % mirror,';time [200[8|9]-mm-dd];cluster humidity [\%]',*(self.time_bins + self.H_bins))
-            cluster_hists[mirror] = {'press':P_hist,'temp':T_hist,'hum':H_hist}
-          cluster_hists[mirror]['press'].Fill(time_diff,press)
-          cluster_hists[mirror]['temp'].Fill(time_diff,temp)
-          cluster_hists[mirror]['hum'].Fill(time_diff,hum)
+    PTH = self.get_PTH()
+    for mirror in numpy.unique(PTH['mirror']):
+      series = PTH[PTH['mirror'] == mirror]
+      time_diffs = series['t']/1000. - self.t0
+      P_hist = TH2F('mirror %d pressure' % mirror,';time [200[8|9]-mm-dd];cluster pressure [Pa]',*(self.time_bins + self.P_bins))
+      T_hist = TH2F('mirror %d temperature' % mirror,';time [200[8|9]-mm-dd];cluster temperature [K]',*(self.time_bins + self.T_bins))
+      H_hist = TH2F('mirror %d humidity' % mirror,';time [200[8|9]-mm-dd];cluster humidity [\%]',*(self.time_bins + self.H_bins))
+      cluster_hists[mirror] = {'press':P_hist,'temp':T_hist,'hum':H_hist}
+      for field in ('press','temp','hum'):
+        fill_arrays(cluster_hists[mirror][field],time_diffs,series[field])
     self.write_kind_plots(cluster_hists,'/home/findlay/data/plots/LED/cluster_%s.ps',xaxis_time=True)
 
+  def get_LED_temp_tuples(self):
+    '''{mirror:[(t,tA,tB,tC,tD)]} in time order'''
+    return self.session_input(('LED_temp_tuples',),self.load_LED_temp_tuples)
+
+  def load_LED_temp_tuples(self):
+    LED_temps = self.get_LED_temps()
+    temp_tuples = {}
+    for mirror in numpy.unique(LED_temps['mirror']):
+      temps = LED_temps[LED_temps['mirror'] == mirror]
+      temp_tuples[int(mirror)] = zip(*[temps[field].tolist() for field in ('t','tA','tB','tC','tD')])
+    return temp_tuples
+
+  def get_PTH_tuples(self):
+    '''{mirror:[(t,press,temp,hum)]} in time order'''
+    return self.session_input(('PTH_tuples',),self.load_PTH_tuples)
+
+  def load_PTH_tuples(self):
+    PTH = self.get_PTH()
+    PTH_tuples = {}
+    for mirror in numpy.unique(PTH['mirror']):
+      series = PTH[PTH['mirror'] == mirror]
+      PTH_tuples[int(mirror)] = zip(*[series[field].tolist() for field in ('t','press','temp','hum')])
+    return PTH_tuples
+
   def plot_AB_average_QDCB(self):
-    temp_tuples = {} # LED temperatures by mirror
-    temp_QDCB_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      notice_branch = self.data['led355'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        if notice.type == 10:
-          try:
-            tA,tB,tC,tD = [float(temp) for temp in re.match(self.LED_temp_regex,notice.text).groups()]
-          except:
-            continue
-          if not notice.pktHdr_crate in temp_QDCB_hists:
-            temp_QDCB_hists[notice.pktHdr_crate] = {}
-            temp_tuples[notice.pktHdr_crate] = []
-          temp_tuples[notice.pktHdr_crate].append((convert_time(notice),tA,tB,tC,tD))
+    temp_tuples = self.get_LED_temp_tuples() # LED temperatures by mirror
+    temp_QDCB_hists = dict((mirror,{}) for mirror in temp_tuples)
     for mirror in temp_QDCB_hists:
       AB_mean_hist = TH2F('mirror %s temp A,B average hmean' % mirror,';temp (A + B)/2 [K];LED flash QDCB means',*(self.LED_AB_bins + self.mean_bins))
       AB_RMS_hist = TH2F('mirror %s temp A,B average hRMS' % mirror,';temp (A + B)/2 [K];LED flash QDCB RMSs',*(self.LED_AB_bins + self.RMS_bins))
@@ -683,23 +786,8 @@ class LEDEnv(Plot):
     self.write_kind_plots(temp_QDCB_hists,'/home/findlay/data/plots/LED/%s.ps')
 
   def plot_temp_QDCB(self):
-    temp_tuples = {} # LED temperatures by mirror
-    temp_QDCB_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      notice_branch = self.data['led355'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        if notice.type == 10:
-          try:
-            tA,tB,tC,tD = [float(temp) for temp in re.match(self.LED_temp_regex,notice.text).groups()]
-          except:
-            continue
-          if not notice.pktHdr_crate in temp_QDCB_hists:
-            temp_QDCB_hists[notice.pktHdr_crate] = {}
-            temp_tuples[notice.pktHdr_crate] = []
-          temp_tuples[notice.pktHdr_crate].append((convert_time(notice),tA,tB,tC,tD))
+    temp_tuples = self.get_LED_temp_tuples() # LED temperatures by mirror
+    temp_QDCB_hists = dict((mirror,{}) for mirror in temp_tuples)
     for mirror in temp_QDCB_hists:
       A_mean_hist = TH2F('mirror %s LED temp A hmean' % mirror,';LED temperature A [K];LED flash QDCB means',*(self.LED_T_bins + self.mean_bins))
       B_mean_hist = TH2F('mirror %s LED temp B hmean' % mirror,';LED temperature B [K];LED flash QDCB means',*(self.LED_T_bins + self.mean_bins))
@@ -729,23 +817,8 @@ class LEDEnv(Plot):
     self.write_kind_plots(temp_QDCB_hists,'/home/findlay/data/plots/LED/%s.ps')
 
   def plot_PTH_QDCB(self):
-    PTH_tuples = {} # cluster PTH by mirror
-    PTH_QDCB_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      notice_branch = self.data['led355'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        if notice.type == 17:
-          match = re.match(self.PTH_regex,notice.text)
-          if match == None : continue
-          groups = match.groups()
-          mirror,press,temp,hum = int(groups[0]),float(groups[1]),float(groups[2]),float(groups[3])
-          if not mirror in PTH_QDCB_hists:
-            PTH_QDCB_hists[mirror] = {}
-            PTH_tuples[mirror] = []
-          PTH_tuples[mirror].append((convert_time(notice),press,temp,hum))
+    PTH_tuples = self.get_PTH_tuples() # cluster PTH by mirror
+    PTH_QDCB_hists = dict((mirror,{}) for mirror in PTH_tuples)
     for mirror in PTH_QDCB_hists:
       P_mean_hist = TH2F('mirror %s cluster press hmean' % mirror,';cluster pressure [Pa];LED flash QDCB means',*(self.P_bins + self.mean_bins))
       T_mean_hist = TH2F('mirror %s cluster temp hmean' % mirror,';cluster temperature [K];LED flash QDCB means',*(self.T_bins + self.mean_bins))
@@ -773,7 +846,7 @@ class CalibHV_QDCB(LEDEnv):
   '''calibrate MDFD'''
 
   def plot_m06_tube_QDCB_means_subcl(self):
-    stat_tuples = self.get_flash_stats_tube()
+    stat_tuples = self.get_flash_stats_tube(6)
     mirror = 6
     mean_QDCB_hists = {mirror:{}}
     for tube in stat_tuples[mirror]:
@@ -788,29 +861,20 @@ class CalibHV_QDCB(LEDEnv):
     self.write_plots('/home/findlay/data/plots/QDCB/m06_tube_QDCB_means_subcl.ps',mean_QDCB_hists[mirror].values())
 
   def plot_m06_tube_HV_means_subcl(self):
-    tube_HV_mean_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      volts_branch = self.data['led355'][hal_stamp]['volts']
-      volts = THPKT1_DST_VOLTS()
-      volts_branch.SetAddress(AddressOf(volts))
-      for entry in xrange(volts_branch.GetEntries()):
-        volts_branch.GetEntry(entry)
-        mirror = volts.pktHdr_crate
-        if not mirror == 6 : continue
-        if not mirror in tube_HV_mean_hists:
-          tube_HV_mean_hists[mirror] = {}
-        for tube in xrange(len(volts.hv)):
-          subcl = tube/16 + 1
-          if not subcl in tube_HV_mean_hists[mirror]:
-            subcl_hist = TProfile('m%02dsubcl%02d' % (mirror,subcl),'m06 mean QDCBs;tube number;tube QDCB mean [counts]',16,16*(subcl - 1),16*(subcl - 1) + 16)
-            subcl_hist.SetFillColor(subcl)
-            subcl_hist.SetLineColor(subcl)
-            tube_HV_mean_hists[mirror][subcl] = subcl_hist
-          tube_HV_mean_hists[mirror][subcl].Fill(tube,volts.hv[tube])
+    mirror = 6
+    tube_HV_mean_hists = {mirror:{}}
+    summary = self.get_HV_summary(mirror=mirror)
+    for subcl in numpy.unique(summary['tube']/16 + 1):
+      subcl_hist = TProfile('m%02dsubcl%02d' % (mirror,subcl),'m06 mean QDCBs;tube number;tube QDCB mean [counts]',16,16*(subcl - 1),16*(subcl - 1) + 16)
+      subcl_hist.SetFillColor(subcl)
+      subcl_hist.SetLineColor(subcl)
+      parts = summary[summary['tube']/16 + 1 == subcl]
+      fill_profile_moments(subcl_hist,parts['tube'],parts['n'],parts['sum'],parts['sumsq'])
+      tube_HV_mean_hists[mirror][subcl] = subcl_hist
     self.write_plots('/home/findlay/data/plots/HV/m06_tube_HV_means_subcl.ps',tube_HV_mean_hists[6].values())
 
   def plot_m06_tube_QDCB_means_mirror(self):
-    stat_tuples = self.get_flash_stats_tube()
+    stat_tuples = self.get_flash_stats_tube(6)
     mean_QDCB_stack = THStack('m06 mean QDCBs','m06 mean QDCBs;tube number;tube QDCB mean [V]')
     hist_legend = TLegend(0.89,0.89,0.90,0.90)
     for mirror in stat_tuples:
@@ -831,58 +895,32 @@ class CalibHV_QDCB(LEDEnv):
     tube_HV_mean_hists = {}
     mean_HV_stack = THStack('m06 mean HVs','m06 mean HVs; ; ')
     hist_legend = TLegend(0.89,0.89,0.90,0.90)
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      volts_branch = self.data['led355'][hal_stamp]['volts']
-      volts = THPKT1_DST_VOLTS()
-      volts_branch.SetAddress(AddressOf(volts))
-      for entry in xrange(volts_branch.GetEntries()):
-        volts_branch.GetEntry(entry)
-        mirror = volts.pktHdr_crate
-        if not mirror == 6 : continue
-        if not mirror in tube_HV_mean_hists:
-          tube_HV_mean_hists[mirror] = {}
-        for tube in xrange(len(volts.hv)):
-          subcl = tube/16 + 1
-          if not subcl in tube_HV_mean_hists[mirror]:
-            subcl_hist = TProfile('m%02dt%03d' % (mirror,tube),';tube number;tube HV mean [V]',self.tubes + 1,0,self.tubes)
-            subcl_hist.SetFillColor(subcl)
-            subcl_hist.SetLineColor(subcl)
-            mean_HV_stack.Add(subcl_hist)
-#            hist_legend.AddEntry(subcl_hist,'subcl %d' % subcl,'f')
-            tube_HV_mean_hists[mirror][subcl] = subcl_hist
-          tube_HV_mean_hists[mirror][subcl].Fill(tube,volts.hv[tube])
+    mirror = 6
+    tube_HV_mean_hists[mirror] = {}
+    summary = self.get_HV_summary(mirror=mirror)
+    for subcl in numpy.unique(summary['tube']/16 + 1):
+      parts = summary[summary['tube']/16 + 1 == subcl]
+      subcl_hist = TProfile('m%02dt%03d' % (mirror,parts['tube'].min()),';tube number;tube HV mean [V]',self.tubes + 1,0,self.tubes)
+      subcl_hist.SetFillColor(subcl)
+      subcl_hist.SetLineColor(subcl)
+      fill_profile_moments(subcl_hist,parts['tube'],parts['n'],parts['sum'],parts['sumsq'])
+      mean_HV_stack.Add(subcl_hist)
+#      hist_legend.AddEntry(subcl_hist,'subcl %d' % subcl,'f')
+      tube_HV_mean_hists[mirror][subcl] = subcl_hist
     self.write_plot('/home/findlay/data/plots/HV/m06_tube_HV_means.ps',mean_HV_stack,legend=hist_legend)
     self.convert_plot_file('/home/findlay/data/plots/HV/m06_tube_HV_means.ps')
 
   def plot_HV_vs_temp(self):
-    pth = {}
-    i = 0
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      pth[hal_stamp] = {}
-      start = self.get_run_start(hal_stamp,'led355')
-      notice_branch = self.data['led355'][hal_stamp]['notice']
-      notice = THPKT1_DST_NOTICE()
-      notice_branch.SetAddress(AddressOf(notice))
-      for entry in xrange(notice_branch.GetEntries()):
-        notice_branch.GetEntry(entry)
-        if notice.type == 17:
-          match = re.match(self.PTH_regex,notice.text)
-          if match == None : continue
-          groups = match.groups()
-          mirror,press,temp,hum = int(groups[0]),float(groups[1]),float(groups[2]),float(groups[3])
-          if not mirror in pth[hal_stamp] :
-            pth[hal_stamp][mirror] = {'press':[],'temp':[],'hum':[]}
-          pth[hal_stamp][mirror]['press'].append(press)
-          pth[hal_stamp][mirror]['temp'].append(temp)
-          pth[hal_stamp][mirror]['hum'].append(hum)
+    # mean cluster temperature of each part
+    PTH = self.get_PTH(mirror=6)
+    mean_temps = {}
+    for key in numpy.unique(PTH['hal_stamp']):
+      mean_temps[key_hal_stamp(key)] = PTH['temp'][PTH['hal_stamp'] == key].mean()
     HV_vs_temp_hists = {}
     for hal_stamp in sorted(self.data['led355'].keys()):
-      start = self.get_run_start(hal_stamp,'led355')
-      volts_branch = self.data['led355'][hal_stamp]['notice']
-      volts = THPKT1_DST_VOLTS()
-      volts_branch.SetAddress(AddressOf(volts))
-      for entry in xrange(volts_branch.GetEntries()):
-        volts_branch.GetEntry(entry)
+      if not str(hal_stamp) in mean_temps : continue
+      volts_packets = self.get_packets(hal_stamp,'led355','volts')
+      for volts in volts_packets:
         mirror = volts.pktHdr_crate
         if not mirror == 6 : continue
         if not mirror in HV_vs_temp_hists:
@@ -892,29 +930,22 @@ class CalibHV_QDCB(LEDEnv):
           #print hal_stamp,mirror,tube,volts.hv[tube] ; raw_input()
           if not tube in HV_vs_temp_hists[mirror]:
             HV_vs_temp_hists[mirror][tube] = TH2I('m%02dt%03d' % (mirror,tube),';temperature [K];HV [V]',*(self.T_bins + (512,0,20)))
-          HV_vs_temp_hists[mirror][tube].Fill(mean(pth[hal_stamp][mirror]['temp']),volts.hv[tube])
+          HV_vs_temp_hists[mirror][tube].Fill(mean_temps[str(hal_stamp)],volts.hv[tube])
     self.write_plots('/home/findlay/data/plots/LED/HV_vs_temp_m06_t000-127.ps',HV_vs_temp_hists[6].values())
 
   def plot_QDCB_vs_HV(self):
-    stat_tuples = self.get_flash_stats_tube()
-    QDCB_vs_HV_hists = {}
-    for hal_stamp in sorted(self.data['led355'].keys()):
-      start = self.get_run_start(hal_stamp,'led355')
-      volts_branch = self.data['led355'][hal_stamp]['volts']
-      volts = THPKT1_DST_VOLTS()
-      volts_branch.SetAddress(AddressOf(volts))
-      for entry in xrange(volts_branch.GetEntries()):
-        volts_branch.GetEntry(entry)
-        mirror = volts.pktHdr_crate
-        if not mirror == 6 : continue
-        if not mirror in QDCB_vs_HV_hists:
-          QDCB_vs_HV_hists[mirror] = {}
-        for tube in xrange(len(volts.hv)):
-          if tube > 128 : continue
-          if not tube in QDCB_vs_HV_hists[mirror]:
-            QDCB_vs_HV_hists[mirror][tube] = TH2I('m%02dt%03d' % (mirror,tube),';HV [V];QDCB LED means',*(self.volts_bins + self.mean_bins))
-          if hal_stamp in stat_tuples[mirror][tube]:
-            QDCB_vs_HV_hists[mirror][tube].Fill(volts.hv[tube],stat_tuples[mirror][tube][hal_stamp][2]) # HV,QDCB mean
+    stat_tuples = self.get_flash_stats_tube(6)
+    mirror = 6
+    QDCB_vs_HV_hists = {mirror:{}}
+    for record in self.get_HV_summary(mirror=mirror):
+      tube = int(record['tube'])
+      if tube > 128 : continue
+      if not tube in QDCB_vs_HV_hists[mirror]:
+        QDCB_vs_HV_hists[mirror][tube] = TH2I('m%02dt%03d' % (mirror,tube),';HV [V];QDCB LED means',*(self.volts_bins + self.mean_bins))
+      hal_stamp = key_hal_stamp(record['hal_stamp'])
+      if tube in stat_tuples[mirror] and hal_stamp in stat_tuples[mirror][tube]:
+        # the part's mean HV, once for each of its volts packets
+        QDCB_vs_HV_hists[mirror][tube].Fill(record['sum']/record['n'],stat_tuples[mirror][tube][hal_stamp][2],record['n']) # HV,QDCB mean
     self.write_plots('/home/findlay/data/plots/LED/QDCB_tube_vs_HV_m06_t000-127.ps',QDCB_vs_HV_hists[6].values())
 
 class CalibTDC_QDCB():
@@ -953,11 +984,8 @@ class CalibTDC_QDCB():
       if '-d' in sys.argv : batch = False
       for hal_stamp in sorted(self.data['led355'].keys()):
         print
-        event_branch = self.data['led355'][hal_stamp]['event']
-        event = THPKT1_DST_EVENT()
-        event_branch.SetAddress(AddressOf(event))
-        for entry in xrange(event_branch.GetEntries()):
-          event_branch.GetEntry(entry)
+        event_packets = self.get_packets(hal_stamp,'led355','event')
+        for entry,event in enumerate(event_packets):
           if mean(event.qdcB) < 800:
             if batch:
               mirror = event.pktHdr_crate
@@ -991,9 +1019,7 @@ class CalibTDC_QDCB():
       part_hists = []
       for hal_stamp in sorted(self.data['led355'].keys()):
         if hal_stamp > HalStamp('y2009m07d01p01'):
-          event_branch = self.data['led355'][hal_stamp]['event']
-          event = THPKT1_DST_EVENT()
-          event_branch.SetAddress(AddressOf(event))
+          event_packets = self.get_packets(hal_stamp,'led355','event')
           part_data.append({'q':{},'t':{}})
           part_hists.append({'hq':{},'ht':{}})
           if batch:
@@ -1002,8 +1028,7 @@ class CalibTDC_QDCB():
             for i in xrange(1,self.mirrors + 1):
               q[i] = []
               t[i] = []
-            for entry in xrange(event_branch.GetEntries()):
-              event_branch.GetEntry(entry)
+            for event in event_packets:
               mirror = event.pktHdr_crate
               for i in xrange(event.ntubes):
                 q[mirror].append(event.qdcB[i])
@@ -1018,8 +1043,7 @@ class CalibTDC_QDCB():
             for m in xrange(1,self.mirrors + 1):
               hq[m] = TH1F('%sm%02dq' % (hal_stamp,m),';QDCB;counts',128,0,4096)
               ht[m] = TH1F('%sm%02dt' % (hal_stamp,m),';TDC;counts',128,0,4096)
-            for entry in xrange(event_branch.GetEntries()):
-              event_branch.GetEntry(entry)
+            for event in event_packets:
               mirror = event.pktHdr_crate
               for i in xrange(event.ntubes):
                 hq[mirror].Fill(event.qdcB[i] + random())
@@ -1034,16 +1058,13 @@ class CalibTDC_QDCB():
     def provisional_calibrate(self):
       for hal_stamp in sorted(self.data['led355'].keys()):
         if hal_stamp > HalStamp('y2009m07d01p01'):
-          event_branch = self.data['led355'][hal_stamp]['event']
-          event = THPKT1_DST_EVENT()
-          event_branch.SetAddress(AddressOf(event))
+          event_packets = self.get_packets(hal_stamp,'led355','event')
           part_data = {}
           for m in xrange(1,self.mirrors + 1):
             part_data[m] = {}
             for t in xrange(self.tubes):
               part_data[m][t] = []
-          for entry in xrange(event_branch.GetEntries()):
-            event_branch.GetEntry(entry)
+          for event in event_packets:
             mirror = event.pktHdr_crate
             for t in xrange(event.ntubes):
               part_data[mirror][event.tube_num[t]].append([True,event.tdc[t],event.qdcB[t]]) # keep,tdc,qdcb
@@ -1,14 +1,25 @@
 #!/usr/bin/env /usr/bin/python
-import os,sys,re,time
+import os,sys,re,time,shutil,cPickle
 from datetime import date,datetime
 from subprocess import call,Popen,PIPE
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 
-from calib import LEDFlashes
+from plot import Catalog,hs_regex,kind_regex
+from calib import refresh_parts
 
 class MDData:
-  def __init__(self):
+  def __init__(self,converter='/home/findlay/bin/hal2root',retries=2):
     self.src_dir = '/tmp/middle_drum/'
+    self.hal_dir = '/home/findlay/data/hal/' # local mirror of the .hal files of src_dir
     self.dest_dir = '/home/findlay/data/middle_drum/' # TODO: move this to /home/findlay/share/middle_drum/data
+    self.manifest_file = '/home/findlay/data/cache/hal.manifest'
+    self.hal_catalog_file = '/home/findlay/data/cache/hal.catalog'
+    self.journal_file = '/home/findlay/data/cache/converted.journal' # "kind hal_stamp root_file" per conversion
+    self.journal_lock = Lock()
+    self.converter = converter # called as converter hal_file root_file
+    self.retries = retries
     self.hal_files = []
     self.led355_files = {}
     self.noise_closed_files = {}
@@ -27,52 +38,167 @@ class MDData:
     if os.path.isdir(self.src_dir):
       os.rmdir(self.src_dir)
 
+  def sync(self,src_dir=None):
+    '''copy the led355, noise-closed and hvcalib .hal files of src_dir
+    (default self.src_dir) that are new or changed since the last sync into
+    hal_dir.  The manifest keeps the source size and mtime of every file
+    copied, and is saved after each copy so that an interrupted sync resumes.
+    Returns the files copied'''
+    src_dir = src_dir or self.src_dir
+    manifest = {} # path relative to src_dir:(size,mtime)
+    if os.path.isfile(self.manifest_file):
+      manifest_file = file(self.manifest_file,'rb')
+      manifest = cPickle.load(manifest_file)
+      manifest_file.close()
+    copied = []
+    for dir,subdirs,files in os.walk(src_dir):
+      subdirs.sort()
+      for name in sorted(files):
+        if not name.endswith('.hal') or not re.search(kind_regex,name) : continue
+        src_file = os.path.join(dir,name)
+        stat = os.stat(src_file)
+        name = os.path.relpath(src_file,src_dir)
+        local_file = os.path.join(self.hal_dir,name)
+        if manifest.get(name) == (stat.st_size,stat.st_mtime) and os.path.isfile(local_file) : continue
+        if not os.path.isdir(os.path.dirname(local_file)):
+          os.makedirs(os.path.dirname(local_file))
+        shutil.copy2(src_file,local_file + '.tmp')
+        os.rename(local_file + '.tmp',local_file)
+        manifest[name] = (stat.st_size,stat.st_mtime)
+        self.save_manifest(manifest)
+        copied.append(local_file)
+    return copied
+
+  def save_manifest(self,manifest):
+    if not os.path.isdir(os.path.dirname(self.manifest_file)):
+      os.makedirs(os.path.dirname(self.manifest_file))
+    manifest_file = file(self.manifest_file + '.tmp','wb')
+    cPickle.dump(manifest,manifest_file,2)
+    manifest_file.close()
+    os.rename(self.manifest_file + '.tmp',self.manifest_file)
+
   def collect_files(self):
-    find_command = 'find %s -type f | grep -E "[0-9]{8}"' % self.src_dir
-    find = Popen(find_command,stdout=PIPE,shell=True)
-    self.hal_files = re.split('\n',find.stdout.read())[:-1]
-    find.stdout.close()
-    for name in self.hal_files:
-      try:
-        hal_stamp = re.search('(y\d{4}m\d{2}d\d{2}p\d{2})',name).group(0)
-        led355,noise_closed,hvcalib = re.search('(led355.hal)|(noise-closed.hal)|(hvcalib.hal)$',name).groups()
-      except:
-        continue
-      if led355:
+    '''list the .hal files of the local mirror by kind and hal stamp'''
+    catalog = Catalog(self.hal_dir,self.hal_catalog_file)
+    catalog.update()
+    for (kind,hal_stamp),part in catalog.parts.items():
+      name = part['path']
+      self.hal_files.append(name)
+      if kind == 'led355':
         self.led355_files[hal_stamp] = name
-      if noise_closed:
+      if kind == 'noise-closed':
         self.noise_closed_files[hal_stamp] = name
-      elif hvcalib:
+      elif kind == 'hvcalib':
         self.hvcalib_files[hal_stamp] = name
 
-  # TODO: use method decorator
-  def convert_files(self):
-    for hal_stamp in sorted(self.led355_files.keys()):
-      self.convert_file(self.led355_files[hal_stamp])
-    for hal_stamp in sorted(self.noise_closed_files.keys()):
-      self.convert_file(self.noise_closed_files[hal_stamp])
-    for hal_stamp in sorted(self.hvcalib_files.keys()):
-      self.convert_file(self.hvcalib_files[hal_stamp])
+  def convert_files(self,processes=None):
+    '''convert the led355, noise-closed and hvcalib files, running up to
+    processes (default one per cpu) converters at once.  Returns the ROOT
+    files written'''
+    hal_files = []
+    for files in (self.led355_files,self.noise_closed_files,self.hvcalib_files):
+      hal_files.extend(files[hal_stamp] for hal_stamp in sorted(files.keys()))
+    pool = ThreadPool(processes or cpu_count()) # each thread waits on a converter process
+    try:
+      root_files = pool.map(self.convert_file,hal_files)
+    finally: # every file is done, or a thread failed
+      pool.terminate()
+      pool.join()
+    return [root_file for root_file in root_files if root_file != None]
 
   def convert_file(self,hal_file):
-    path,name = os.path.split(re.split(self.src_dir,hal_file)[1])
+    '''convert hal_file to a ROOT file below dest_dir unless it is there
+    already.  The converter writes to a temporary name that is renamed into
+    place only once it succeeds, so an interrupted conversion is redone; a
+    failed one, including one that raises, is retried.  Returns the ROOT file
+    written, or None'''
+    path,name = os.path.split(os.path.relpath(hal_file,self.hal_dir))
     base = os.path.splitext(name)[0]
     dest = os.path.join(self.dest_dir,path)
-    if not os.path.isdir(dest):
-      os.makedirs(dest)
     root_file = '%s.root' % os.path.join(dest,base)
-    if not os.path.isfile(root_file):
-      call(('/home/findlay/bin/hal2root',hal_file,root_file))
-      print hal_file
+    if os.path.isfile(root_file) : return None
+    tmp_file = '%s.tmp.root' % os.path.join(dest,base)
+    for attempt in xrange(self.retries + 1):
+      try:
+        try:
+          os.makedirs(dest)
+        except OSError:
+          if not os.path.isdir(dest) : raise # made by another thread is fine
+        if call((self.converter,hal_file,tmp_file)) == 0 and os.path.isfile(tmp_file):
+          self.journal(root_file) # first, so that a part renamed into place is always journaled
+          os.rename(tmp_file,root_file)
+          print hal_file
+          return root_file
+      except Exception,error: # e.g. no converter
+        print >> sys.stderr,'%s: attempt %d: %s' % (hal_file,attempt + 1,error)
+      if os.path.isfile(tmp_file) : os.remove(tmp_file)
+    print >> sys.stderr,'%s: conversion failed after %d attempts' % (hal_file,self.retries + 1)
+    return None
+
+  def journal(self,root_file):
+    '''record a newly converted part for the stages downstream'''
+    name = os.path.basename(root_file)
+    line = '%s %s %s\n' % (re.search(kind_regex,name).group(1),re.search(hs_regex,name).group(0),root_file)
+    self.journal_lock.acquire()
+    try:
+      if not os.path.isdir(os.path.dirname(self.journal_file)):
+        os.makedirs(os.path.dirname(self.journal_file))
+      journal = file(self.journal_file,'a')
+      journal.write(line)
+      journal.flush()
+      os.fsync(journal.fileno())
+      journal.close()
+    finally:
+      self.journal_lock.release()
+
+  def pending_parts(self):
+    '''{kind:{hal_stamp:root_file}} converted since the last mark_done'''
+    parts = {}
+    done = 0
+    if os.path.isfile(self.journal_file + '.done'):
+      done = int(file(self.journal_file + '.done').read())
+    self.done_offset = done
+    self.pending = [] # (kind,hal_stamp,offset past its line) in journal order
+    self.finished = set()
+    if os.path.isfile(self.journal_file):
+      journal = file(self.journal_file)
+      journal.seek(done)
+      for line in journal:
+        if not line.endswith('\n') : break # torn write
+        kind,hal_stamp,root_file = line.split()
+        parts.setdefault(kind,{})[hal_stamp] = root_file
+        done += len(line)
+        self.pending.append((kind,hal_stamp,done))
+      journal.close()
+    return parts
+
+  def mark_done(self,kind=None,hal_stamp=None):
+    '''a part returned by pending_parts has been processed (by default all of
+    them).  The done offset advances past every journal line up to the first
+    part not yet processed, so that an interrupted run resumes from there'''
+    if kind == None : self.finished.update((kind,hal_stamp) for kind,hal_stamp,offset in self.pending)
+    else : self.finished.add((kind,hal_stamp))
+    for kind,hal_stamp,offset in self.pending:
+      if not (kind,hal_stamp) in self.finished : break
+      self.done_offset = offset
+    done = file(self.journal_file + '.done.tmp','w')
+    done.write('%d\n' % self.done_offset)
+    done.close()
+    os.rename(self.journal_file + '.done.tmp',self.journal_file + '.done')
 
 def main():
   md = MDData()
   md.mount_server()
+  md.sync()
+  md.unmount_server()
   md.collect_files()
   md.convert_files()
-  md.unmount_server()
 
-  lf = LEDFlashes()
-  lf.make_flash_stats('/tmp/flash_stats_cluster.gz','/tmp/flash_stats_tube.gz')
+  # derive stats from the newly converted parts only
+  parts = md.pending_parts()
+  for kind in parts:
+    if kind != 'led355':
+      for hal_stamp in parts[kind] : md.mark_done(kind,hal_stamp) # nothing derived yet
+  refresh_parts(parts.get('led355',{}),processes=cpu_count(),done=lambda hal_stamp:md.mark_done('led355',hal_stamp))
 
 if __name__ == '__main__' : main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env /usr/bin/python
-import os,sys,re,gzip,csv,numpy
+import os,sys,re,gzip,csv,shutil,cPickle,fcntl,numpy
 from math import fabs,fsum
 from getopt import getopt
 from random import random
-from time import localtime,mktime,strptime,time
+from time import gmtime,localtime,mktime,strptime,time
 from calendar import timegm
+from collections import OrderedDict
 from datetime import datetime
 from subprocess import call,Popen,PIPE
+from itertools import izip
+from operator import attrgetter
 from numpy import mean,std
 from scipy import optimize
 
@@ -22,101 +25,317 @@ from ROOT import THPKT1_DST_EVENT,THPKT1_DST_NOTICE,THPKT1_DST_TIME,THPKT1_DST_T
 
 hs_regex = re.compile(r'(y\d{4}m\d{2}d\d{2}p\d{2})') # fully qualified hal stamp regular expression
 HS_regex = re.compile(r'(y\d{4}m\d{2}d\d{2})p(\d{2})') # now capturing date stamp and part stamp value
+kind_regex = re.compile(r'(led355|noise-closed|hvcalib)\.(?:hal|root)$') # part kind from file name
+#hal_stamp := year month day part mirror [tube]
+flash_stats_cluster_regex = re.compile(r'^(\d+) (y\d{4}m\d{2}d\d{2}p\d{2})m(\d{2}) (\d+) (\d+) (\S+) (\S+) (\S+) (\S+) (\S+)$')
+flash_stats_tube_regex    = re.compile(r'^(\d+) (y\d{4}m\d{2}d\d{2}p\d{2})m(\d{2})t(\d{3}) (\d+) (\d+) (\S+) (\S+) (\S+) (\S+) (\S+)$')
 
-class HalStamp:
-  def __init__(self,hs=None):
-    if hs != None:
-      self.hs = hs
-      date,part = re.match(HS_regex,hs).groups()
-      self.dt = datetime(*strptime(date,'y%Ym%md%d')[:5])
-      self.part = int(part)
-    else:
-      self.hs = None
-      self.dt = None
-      self.part = None
+branch_types = ('time','event','snapshot','minute','threshold','countrate','volts','notice','remote','calib','boardid','mstat')
+
+# flash stats records; hal stamps are stored as yyyymmddpp integers and
+# cluster records have tube -1
+flash_stats_dtype = numpy.dtype([('i',numpy.int64),('hal_stamp',numpy.int64),('mirror',numpy.int16),('tube',numpy.int16),
+    ('t',numpy.int64),('hents',numpy.int32),('hmean',numpy.float64),('hRMS',numpy.float64),
+    ('const',numpy.float64),('mean',numpy.float64),('sigma',numpy.float64)])
+
+# columns kept by the packet cache for each branch type:  (scalar fields,
+# field counting the ragged fields of each entry, ragged fields)
+packet_classes = {'event':THPKT1_DST_EVENT,'notice':THPKT1_DST_NOTICE,'time':THPKT1_DST_TIME,'volts':THPKT1_DST_VOLTS,'threshold':THPKT1_DST_THRESHOLD}
+packet_fields = {
+    'event':(('pktHdr_crate','event','version','minute','msec','ntubes'),'ntubes',('tube_num','qdcB','tdc')),
+    'notice':(('pktHdr_crate','type','year','day','hour','min','sec','msec','text'),None,()),
+    'time':(('pktHdr_crate','year','day','sec','events'),'events',('mirror','msec','nsec')),
+    'volts':(('pktHdr_crate','minute','obVer','hvChnls',
+        'ob_p12v','ob_p05v','ob_n12v','ob_n05v','ob_tdcRef','ob_temp','ob_thRef','ob_gnd',
+        'garb_temp','garb_p12v','garb_n12v','garb_p05v','garb_s05v','garb_lemo1','garb_anlIn',
+        'garb_clsVolts','garb_clsTemp','garb_mirX','garb_mirY','garb_clsX','garb_clsY','garb_ns',
+        'garb_hvSup','garb_hvChnl'),'hvChnls',('hv',)),
+    'threshold':(('pktHdr_crate','min'),None,('thB',))} # thB is a fixed length array
+
+tree_cache_size = 32*1024*1024 # bytes of baskets a TTree reads ahead
+
+# per part summaries of the led355 volts packets:  moments of each hv channel
+# by (hal_stamp,mirror,tube), and means of the board voltages by (hal_stamp,mirror)
+board_fields = packet_fields['volts'][0][4:]
+HV_summary_dtype = numpy.dtype([('hal_stamp',numpy.int64),('mirror',numpy.int16),('tube',numpy.int16),('n',numpy.int32),
+    ('sum',numpy.float64),('sumsq',numpy.float64),('min',numpy.float64),('max',numpy.float64)])
+board_summary_dtype = numpy.dtype([('hal_stamp',numpy.int64),('mirror',numpy.int16),('n',numpy.int32)] +
+    [(field,numpy.float64) for field in board_fields])
+
+# environment series parsed from led355 notices:  LED temperatures (type 10)
+# by packet crate, and cluster pressure, temperature, humidity (type 17) by
+# the mirror named in the text; t is epoch milliseconds
+LED_temp_regex = re.compile(r'^TEMP A (\S+) B (\S+) C (\S+) D (\S+)$')
+PTH_regex = re.compile(r'^m(\d{1,2}): @\d+ (\S+) (\S+) (\S+)')
+LED_temp_dtype = numpy.dtype([('hal_stamp',numpy.int64),('mirror',numpy.int16),('t',numpy.int64),
+    ('tA',numpy.float64),('tB',numpy.float64),('tC',numpy.float64),('tD',numpy.float64)])
+PTH_dtype = numpy.dtype([('hal_stamp',numpy.int64),('mirror',numpy.int16),('t',numpy.int64),
+    ('press',numpy.float64),('temp',numpy.float64),('hum',numpy.float64)])
+
+class HalStamp(object):
+  '''hal stamp of a part, ordered by its yyyymmddpp integer key.  Stamps are
+  interned, so equal stamps are the same object.  A stamp hashes and compares
+  equal to its string, so that either may be used as a dict key'''
+  __slots__ = ('hs','key','part')
+  interned = {}
+
+  def __new__(cls,hs=None):
+    if isinstance(hs,HalStamp) : return hs
+    stamp = cls.interned.get(hs)
+    if stamp is None:
+      stamp = object.__new__(cls)
+      if hs is None:
+        stamp.hs = stamp.key = stamp.part = None
+      else:
+        date,part = re.match(HS_regex,hs).groups()
+        stamp.hs = hs
+        stamp.key = int(date[1:5] + date[6:8] + date[9:11] + part)
+        stamp.part = int(part)
+      cls.interned[hs] = stamp
+    return stamp
+
+  def __reduce__(self): # unpickle through __new__, and so the interned stamp
+    return (HalStamp,(self.hs,))
+
+  @property
+  def dt(self):
+    if self.key is None : return None
+    return datetime(self.key/1000000,self.key/10000%100,self.key/100%100)
 
   def __repr__(self):
-    if self.hs == None : return 'None'
+    if self.hs is None : return 'None'
     else : return self.hs
 
   def __str__(self):
-    if self.hs == None : return 'None'
+    if self.hs is None : return 'None'
     else : return self.hs
 
   def __hash__(self):
-    return int(timegm(self.dt.timetuple())) + self.part
+    return hash(self.hs) # the hash of the string, to match str keys
 
-  def __lt__(self,other): # x < y
-    if self.dt == None or other.dt == None : return False
-    if self.dt < other.dt : return True
-    if self.dt == other.dt and self.part < other.part : return True
-    else : return False
-
-  def __le__(self,other): # x <= y
-    if self.dt == None or other.dt == None : return False
-    if self.dt < other.dt : return True
-    if self.dt == other.dt and self.part <= other.part : return True
-    else : return False
+  def other_key(self,other):
+    if isinstance(other,HalStamp) : return other.key
+    if isinstance(other,basestring) : return HalStamp(other).key
+    return None
 
   def __eq__(self,other): # x == y
-    if other == None:
-      if self.dt == other : return True
-      else : return False
-    if self.dt == other.dt and self.part == other.part : return True
-    else : return False
+    if isinstance(other,HalStamp) : return self.key == other.key
+    if isinstance(other,basestring) : return self.hs == other
+    return self.hs is None and other is None
 
   def __ne__(self,other): # x != y
-    if other == None:
-      if self.dt != other : return True
-      else : return False
-    if self.dt != other.dt : return True
-    if self.dt == other.dt and self.part != other.part : return True
-    else : return False
+    return not self == other
+
+  def __lt__(self,other): # x < y
+    key = self.other_key(other)
+    return self.key is not None and key is not None and self.key < key
+
+  def __le__(self,other): # x <= y
+    key = self.other_key(other)
+    return self.key is not None and key is not None and self.key <= key
 
   def __ge__(self,other): # x >= y
-    if self.dt == None or other.dt == None : return False
-    if self.dt > other.dt : return True
-    if self.dt == other.dt and self.part >= other.part : return True
-    else : return False
+    key = self.other_key(other)
+    return self.key is not None and key is not None and self.key >= key
 
   def __gt__(self,other): # x > y
-    if self.dt == None or other.dt == None : return False
-    if self.dt > other.dt : return True
-    if self.dt == other.dt and self.part > other.part : return True
-    else : return False
+    key = self.other_key(other)
+    return self.key is not None and key is not None and self.key > key
+
+def hal_stamp_key(hal_stamp):
+  '''yyyymmddpp integer of a hal stamp'''
+  if isinstance(hal_stamp,HalStamp) : return hal_stamp.key
+  return int(re.sub(r'\D','',str(hal_stamp)))
+
+def key_hal_stamp(key):
+  '''hal stamp string of a yyyymmddpp integer'''
+  key = int(key)
+  return 'y%04dm%02dd%02dp%02d' % (key/1000000,key/10000%100,key/100%100,key%100)
+
+def epoch_days(year,day):
+  '''days from the epoch to the given day of the year (January 1st is day 1)'''
+  leap_days = lambda y : y//4 - y//100 + y//400
+  return 365*(year - 1970) + leap_days(year - 1) - leap_days(1969) + day - 1
+
+def convert_times(year,day,sec,msec,utc=False):
+  '''convert arrays of year, day of year, second of day and millisecond to
+  (integral) epoch milliseconds.  Like the mktime convert_time has always
+  used, times are taken as local time unless utc is set'''
+  year,day,sec,msec = [numpy.asarray(a,dtype=numpy.int64) for a in (year,day,sec,msec)]
+  seconds = 86400*epoch_days(year,day) + sec
+  if not utc:
+    # the local offset only changes on the hour, so ask mktime once per hour
+    hours,index = numpy.unique(seconds//3600,return_inverse=True)
+    offsets = numpy.array([int(mktime(gmtime(3600*int(hour))[:8] + (-1,))) - 3600*int(hour) for hour in hours],dtype=numpy.int64)
+    seconds = seconds + offsets[index].reshape(seconds.shape)
+  return 1000*seconds + msec
+
+def packet_times(packets,utc=False):
+  '''epoch milliseconds of every entry of a notice Packets table, or of every
+  tevent of a time Packets table'''
+  if packets.branch_type == 'notice':
+    sec = 3600*packets['hour'].astype(numpy.int64) + 60*packets['min'] + packets['sec']
+    return convert_times(packets['year'],packets['day'],sec,packets['msec'],utc)
+  elif packets.branch_type == 'time':
+    entries = packets.entries()
+    return convert_times(packets['year'][entries],packets['day'][entries],packets['sec'][entries],packets['msec'],utc)
 
 def convert_time(packet,tevent=None):
   '''convert packet timestamp to (integral) epoch milliseconds'''
-  if type(packet) == type(THPKT1_DST_NOTICE()):
-    time_stamp = '%d %d %02d:%02d:%02d' % (packet.year,packet.day,packet.hour,packet.min,packet.sec)
-    return int(1000*mktime(strptime(time_stamp,'%Y %j %H:%M:%S')) + packet.msec)
-  elif type(packet) == type(THPKT1_DST_TIME()):
-    hour = packet.sec/3600
-    min = packet.sec%3600/60
-    sec = packet.sec%3600%60
-    time_stamp = '%d %d %02d:%02d:%02d' % (packet.year,packet.day,hour,min,sec)
-    return int(1000*mktime(strptime(time_stamp,'%Y %j %H:%M:%S')) + packet.msec[tevent])
+  if isinstance(packet,Packet) : branch_type = packet.packets.branch_type
+  else : branch_type = None
+  if branch_type == 'notice' or isinstance(packet,THPKT1_DST_NOTICE):
+    sec = 3600*packet.hour + 60*packet.min + packet.sec
+    return int(convert_times(packet.year,packet.day,sec,packet.msec))
+  elif branch_type == 'time' or isinstance(packet,THPKT1_DST_TIME):
+    return int(convert_times(packet.year,packet.day,packet.sec,packet.msec[tevent]))
   else:
     return None
 
+def part_run_start(notice_packets):
+  '''epoch milliseconds of the first RUN START notice of a part, or None'''
+  run_starts = numpy.flatnonzero(notice_packets['type'] == 8) # event time is measured as offset from first RUN START
+  if len(run_starts) == 0 : return None
+  return convert_time(notice_packets.packet(run_starts[0]))
+
+def asof_join(timesA,timesB,direction='nearest',tolerance=None):
+  '''timesA and timesB are sorted arrays of times.  For each time in timesA,
+  find by binary search the last time in timesB at or before it (backward),
+  the first at or after it (forward) or the closest one (nearest, ties going
+  to the later time, and to the last of equal times).  Return the index
+  arrays into timesA and timesB of the pairs found, leaving out those more
+  than tolerance apart'''
+  timesA = numpy.asarray(timesA)
+  timesB = numpy.asarray(timesB)
+  if len(timesA) == 0 or len(timesB) == 0:
+    return numpy.zeros(0,dtype=numpy.int64),numpy.zeros(0,dtype=numpy.int64)
+  before = numpy.searchsorted(timesB,timesA,side='right') - 1
+  after = numpy.searchsorted(timesB,timesA,side='left')
+  valid = after < len(timesB)
+  after[valid] = numpy.searchsorted(timesB,timesB[after[valid]],side='right') - 1 # last of equal times
+  if direction == 'backward':
+    indexB = before
+  elif direction == 'forward':
+    indexB = after
+  elif direction == 'nearest':
+    before = before.clip(0,len(timesB) - 1)
+    after = after.clip(0,len(timesB) - 1)
+    later = numpy.abs(timesB[after] - timesA) <= numpy.abs(timesA - timesB[before])
+    indexB = numpy.where(later,after,before)
+  else:
+    raise ValueError('unknown direction %s' % direction)
+  found = (indexB >= 0) & (indexB < len(timesB))
+  if tolerance != None:
+    found[found] = numpy.abs(timesB[indexB[found]] - timesA[found]) <= tolerance
+  return numpy.flatnonzero(found),indexB[found]
+
+def asof_join_groups(timesA,timesB,direction='nearest',tolerance=None):
+  '''asof_join each group (e.g. mirror) of a dict of sorted time arrays with
+  the same group of another; groups missing from either side are left out'''
+  pairs = {}
+  for group in timesA:
+    if group in timesB:
+      pairs[group] = asof_join(timesA[group],timesB[group],direction,tolerance)
+  return pairs
+
 def find_nearest_tuple(listA,listB):
   '''listA and listB are lists of tuples of numbers and are sorted by the
   first number in their tuples.  For each tuple in listA, associate a tuple
   in listB whose first number is closest to the first number from the tuple
   of listA'''
-  listC = []
-  last_tupleB = listB[0]
-  for tupleA in listA:
-    last_diff = fabs(tupleA[0] - last_tupleB[0]) + 1
-    new_listB = listB[listB.index(last_tupleB):]
-    for tupleB in new_listB:
-      if fabs(tupleA[0] - tupleB[0]) <= last_diff:
-        last_tupleB = tupleB
-        last_diff = fabs(tupleA[0] - last_tupleB[0])
-      else:
-        break
-    listC.append(tupleA + last_tupleB)
-  return listC
+  indexA,indexB = asof_join([tupleA[0] for tupleA in listA],[tupleB[0] for tupleB in listB])
+  return [listA[a] + listB[b] for a,b in zip(indexA,indexB)]
+
+def fill_arrays(hist,x,y=None,w=None):
+  '''fill a 1D (x) or 2D (x,y) histogram from arrays in one call'''
+  if len(x) == 0 : return
+  x = numpy.ascontiguousarray(x,dtype=numpy.float64)
+  if w is None : w = numpy.ones(len(x))
+  else : w = numpy.ascontiguousarray(w,dtype=numpy.float64)
+  if y is None : hist.FillN(len(x),x,w)
+  else : hist.FillN(len(x),x,numpy.ascontiguousarray(y,dtype=numpy.float64),w)
+
+def import_flash_stats(gz_file,store,chunk=100000):
+  '''one-time conversion of a gzip text flash stats file into a RecordStore'''
+  records = []
+  for line in gzip.open(gz_file,'r'):
+    match = re.match(flash_stats_tube_regex,line)
+    if match:
+      i,hal_stamp,mirror,tube,t,hents,hmean,hRMS,const,mean,sigma = match.groups()
+    else:
+      match = re.match(flash_stats_cluster_regex,line)
+      if match == None : continue
+      i,hal_stamp,mirror,t,hents,hmean,hRMS,const,mean,sigma = match.groups()
+      tube = -1
+    records.append((int(i),hal_stamp_key(hal_stamp),int(mirror),int(tube),int(t),int(hents),
+        float(hmean),float(hRMS),float(const),float(mean),float(sigma)))
+    if len(records) == chunk:
+      store.append(records)
+      records = []
+  store.append(records)
+  store.rebuild_journal()
+
+def fit_lines(groups,x,y,w=None,intercept=True):
+  '''closed form weighted least squares fit of y = m*x + b (or y = m*x) to the
+  points of every group at once; groups are integers 0..n-1.  Returns arrays
+  (m,m_err,b,b_err) where the errors are the diagonal of the unscaled
+  covariance (X^T W X)^-1, as optimize.leastsq reports it'''
+  groups = numpy.asarray(groups)
+  x = numpy.asarray(x,dtype=numpy.float64)
+  y = numpy.asarray(y,dtype=numpy.float64)
+  if w is None : w = numpy.ones(len(x))
+  n = groups.max() + 1 if len(groups) else 0
+  S = numpy.bincount(groups,w,n)
+  Sx = numpy.bincount(groups,w*x,n)
+  Sxx = numpy.bincount(groups,w*x*x,n)
+  Sy = numpy.bincount(groups,w*y,n)
+  Sxy = numpy.bincount(groups,w*x*y,n)
+  if not intercept:
+    return Sxy/Sxx,1/Sxx,numpy.zeros(n),numpy.zeros(n)
+  det = S*Sxx - Sx**2
+  m = (S*Sxy - Sx*Sy)/det
+  b = (Sxx*Sy - Sx*Sxy)/det
+  return m,S/det,b,Sxx/det
+
+def read_HV_calib_steps(file_name,mirrors=14):
+  '''{hal_stamp:{mirror:steps}} from a calibration step table, with 'notice' in
+  place of the dict for parts whose steps are in their notice packets'''
+  HV_calib_steps = {}
+  for line in file(file_name):
+    fields = line.split('#')[0].split()
+    if not fields : continue
+    hal_stamp,part_mirrors,steps = fields
+    if steps == 'notice':
+      HV_calib_steps[hal_stamp] = 'notice'
+      continue
+    HV_calib_steps[hal_stamp] = {}
+    if steps == 'none' : continue
+    if part_mirrors == 'all' : part_mirrors = range(1,mirrors + 1)
+    else : part_mirrors = [int(mirror) for mirror in part_mirrors.split(',')]
+    for mirror in part_mirrors:
+      HV_calib_steps[hal_stamp][mirror] = tuple(float(step) for step in steps.split(','))
+  return HV_calib_steps
+
+def notice_HV_calib_steps(notice_packets):
+  '''{mirror:steps} from supply voltages entered by hand as notices, one
+  rising list per mirror in mirror order'''
+  step_voltages = {}
+  mirror = 1
+  for text in notice_packets['text']:
+    match = re.search(r'^([0-9.]+)$',str(text))
+    if match == None : continue
+    try:
+      voltage_step = float(match.group(1))
+    except ValueError:
+      continue
+    if len(step_voltages) == 0:
+      step_voltages[mirror] = [voltage_step]
+    elif voltage_step < step_voltages[mirror][-1]:
+      mirror += 1
+      step_voltages[mirror] = [voltage_step]
+    else:
+      step_voltages[mirror].append(voltage_step)
+  return step_voltages
 
 def compute_bins(array):
   if len(array) < 2 : return (3,array[0] - 0.1*array[0],array[0] + 0.1*array[0])
@@ -139,51 +358,738 @@ def compute_bins(array):
   else : nbins = int((max - min)/binw)
   return (nbins,min,max)
 
+def segment_bins(values,offsets,counts=None):
+  '''compute_bins for every segment values[offsets[k]:offsets[k + 1]] at once,
+  each value occurring counts times (default once); returns arrays of
+  (nbins,min,max)'''
+  values = numpy.asarray(values,dtype=numpy.float64)
+  offsets = numpy.asarray(offsets,dtype=numpy.int64)
+  if counts is None : counts = numpy.ones(len(values),dtype=numpy.int64)
+  segments = numpy.repeat(numpy.arange(len(offsets) - 1),numpy.diff(offsets))
+  order = numpy.lexsort((values,segments))
+  sarray,cumulative = values[order],numpy.cumsum(numpy.asarray(counts)[order])
+  # index of the (start + index)th value of the sorted, expanded segments
+  start = numpy.concatenate(([0],cumulative))[offsets[:-1]]
+  n = numpy.concatenate(([0],cumulative))[offsets[1:]] - start
+  at = lambda index : sarray[numpy.searchsorted(cumulative,start + index.clip(0,None),'right').clip(0,max(len(sarray) - 1,0))] if len(sarray) else numpy.zeros(len(n))
+  # interquartile range
+  index = (n/2 + 1)/2
+  even = (n%4 == 0) | (n%4 == 1)
+  first = numpy.where(even,(at(index - 1) + at(index))/2.0,at(index - 1))
+  third = numpy.where(even,(at(n - index - 1) + at(n - index))/2.0,at(n - index))
+  # # bins, bin width (Freedman-Diaconis' choice)
+  low = at(numpy.zeros(len(n),dtype=numpy.int64))
+  high = at(n - 1) + 1
+  binw = 2*(third - first)/numpy.maximum(n,1)**(1/3.)
+  nbins = numpy.where(binw == 0,1,((high - low)/numpy.where(binw == 0,1,binw)).astype(numpy.int64)).clip(1,None)
+  # single values and empty segments as in compute_bins
+  nbins = numpy.where(n == 1,3,numpy.where(n == 0,1,nbins))
+  low,high = numpy.where(n == 1,low - 0.1*low,low),numpy.where(n == 1,low + 0.1*low,high)
+  low,high = numpy.where(n == 0,0,low),numpy.where(n == 0,1,high)
+  return nbins,low,high
+
+def fit_gaus_segments(values,offsets,nbins,low,high,weights=None,iterations=50):
+  '''histogram each segment values[offsets[k]:offsets[k + 1]] in its own
+  (nbins,low,high) bins and fit a gaussian to every histogram at once by a
+  binned Poisson likelihood, as TH1::Fit('gaus','LL') does.  log(gaus) is a
+  quadratic in x, so the fit is a log-linear Poisson regression solved by
+  Newton steps with one 3x3 system per segment.  Returns arrays of
+  (hents,hmean,hRMS,const,mean,sigma); segments with fewer than three filled
+  bins keep their histogram mean and RMS, with the tallest bin as const'''
+  values = numpy.asarray(values,dtype=numpy.float64)
+  offsets = numpy.asarray(offsets,dtype=numpy.int64)
+  nseg = len(offsets) - 1
+  n = numpy.diff(offsets)
+  segments = numpy.repeat(numpy.arange(nseg),n)
+  if weights is None : weights = numpy.ones(len(values))
+  nbins = numpy.asarray(nbins,dtype=numpy.int64)
+  low = numpy.asarray(low,dtype=numpy.float64)
+  binw = (numpy.asarray(high,dtype=numpy.float64) - low)/nbins
+  # histogram statistics exclude under/overflows, like TH1::GetMean/GetRMS
+  local = numpy.floor((values - low[segments])/binw[segments]).astype(numpy.int64)
+  inside = (local >= 0) & (local < nbins[segments])
+  hents = numpy.bincount(segments,weights,nseg)
+  sumw = numpy.bincount(segments[inside],weights[inside],nseg)
+  sumwx = numpy.bincount(segments[inside],(weights*values)[inside],nseg)
+  sumwx2 = numpy.bincount(segments[inside],(weights*values**2)[inside],nseg)
+  hmean = sumwx/numpy.where(sumw == 0,1,sumw)
+  hRMS = numpy.sqrt(numpy.maximum(sumwx2/numpy.where(sumw == 0,1,sumw) - hmean**2,0))
+  # flat bins of all histograms
+  bin_offsets = numpy.concatenate(([0],numpy.cumsum(nbins)))
+  counts = numpy.bincount((bin_offsets[:-1][segments] + local)[inside],weights[inside],bin_offsets[-1])
+  bin_segments = numpy.repeat(numpy.arange(nseg),nbins)
+  centers = low[bin_segments] + (numpy.arange(bin_offsets[-1]) - bin_offsets[:-1][bin_segments] + 0.5)*binw[bin_segments]
+  # fit in standardized units u = (x - hmean)/scale so the systems are well conditioned
+  scale = numpy.where(hRMS > 0,hRMS,binw)
+  u = (centers - hmean[bin_segments])/scale[bin_segments]
+  powers = numpy.array([numpy.ones(len(u)),u,u**2,u**3,u**4])
+  theta = numpy.zeros((nseg,3))
+  theta[:,0] = numpy.log(numpy.maximum(sumw*binw/(numpy.sqrt(2*numpy.pi)*scale),1e-300))
+  theta[:,2] = -0.5
+  filled = numpy.bincount(bin_segments,counts > 0,nseg) >= 3
+  def loglik(theta):
+    eta = theta[bin_segments,0] + theta[bin_segments,1]*u + theta[bin_segments,2]*u**2
+    mu = numpy.exp(numpy.minimum(eta,700))
+    return mu,numpy.bincount(bin_segments,counts*eta - mu,nseg)
+  mu,L = loglik(theta)
+  active = filled.copy()
+  for iteration in xrange(iterations):
+    if not active.any() : break
+    g = numpy.array([numpy.bincount(bin_segments,(counts - mu)*powers[k],nseg) for k in xrange(3)]).T
+    h = numpy.array([numpy.bincount(bin_segments,mu*powers[k],nseg) for k in xrange(5)]).T
+    H = numpy.array([[h[:,0],h[:,1],h[:,2]],[h[:,1],h[:,2],h[:,3]],[h[:,2],h[:,3],h[:,4]]]).transpose(2,0,1)
+    H[~active] = numpy.eye(3)
+    H += 1e-12*numpy.eye(3)
+    step = numpy.linalg.solve(H,g[:,:,None])[:,:,0]
+    step[~active] = 0
+    # halve the steps of segments whose likelihood would fall
+    for halving in xrange(20):
+      new_mu,new_L = loglik(theta + step)
+      worse = active & ~(new_L >= L - 1e-9*numpy.abs(L))
+      if not worse.any() : break
+      step[worse] /= 2
+    theta += step
+    mu,L = new_mu,new_L
+    active &= numpy.abs(step).max(axis=1) > 1e-10
+  a,b,c = theta[:,0],theta[:,1],theta[:,2]
+  good = filled & (c < 0)
+  c = numpy.where(good,c,-0.5)
+  const = numpy.exp(numpy.minimum(a - b**2/(4*c),700))
+  mean = hmean + scale*(-b/(2*c))
+  sigma = scale*numpy.sqrt(-1/(2*c))
+  tallest = numpy.zeros(nseg)
+  numpy.maximum.at(tallest,bin_segments,counts)
+  const = numpy.where(good,const,tallest)
+  mean = numpy.where(good,mean,hmean)
+  sigma = numpy.where(good,sigma,hRMS)
+  return hents,hmean,hRMS,const,mean,sigma
+
+def gaus_flash_stats(values,offsets,validate=0,counts=None):
+  '''(hents,hmean,hRMS,const,mean,sigma) arrays of the QDC values of every
+  segment, binned with compute_bins and fit like TH1::Fit('gaus','LL').  QDC
+  values are integers, so each is spread randomly through its unit interval
+  first.  Given counts of each value (a histogram), each value stands at the
+  middle of its interval instead, and the RMS gets the 1/12 variance of the
+  spread back.  With validate, that many random segments are refit with ROOT
+  and the differences printed'''
+  bins = segment_bins(values,offsets,counts)
+  if counts is None:
+    spread = numpy.asarray(values,dtype=numpy.float64) + numpy.random.random_sample(len(values))
+    stats = fit_gaus_segments(spread,offsets,*bins)
+  else:
+    spread = numpy.asarray(values,dtype=numpy.float64) + 0.5
+    stats = fit_gaus_segments(spread,offsets,*bins,weights=numpy.asarray(counts,dtype=numpy.float64))
+    hents,hmean,hRMS,const,mean,sigma = stats
+    stats = hents,hmean,numpy.where(hents > 0,numpy.sqrt(hRMS**2 + 1/12.),hRMS),const,mean,sigma
+  if validate:
+    validate_gaus_fits(spread,offsets,bins,stats,validate,counts)
+  return stats
+
+def validate_gaus_fits(values,offsets,bins,stats,sample,counts=None):
+  '''refit a random sample of segments with TH1F.Fit('gaus','LL Q') and print
+  both results; returns the largest relative differences of (mean,sigma)'''
+  if counts is None : counts = numpy.ones(len(values))
+  nbins,low,high = bins
+  worst = [0.,0.]
+  segments = numpy.flatnonzero(numpy.diff(offsets) > 0)
+  for k in numpy.random.permutation(segments)[:sample]:
+    h = TH1F('validate %d' % k,';QDCB;tubes',int(nbins[k]),low[k],high[k])
+    for value,count in izip(values[offsets[k]:offsets[k + 1]],counts[offsets[k]:offsets[k + 1]]) : h.Fill(value,count)
+    h.Fit('gaus','LL Q')
+    gaus = h.GetListOfFunctions().FindObject('gaus')
+    root = (h.GetEntries(),h.GetMean(),h.GetRMS(),gaus.GetParameter(0),gaus.GetParameter(1),fabs(gaus.GetParameter(2)))
+    engine = tuple(stat[k] for stat in stats)
+    print 'segment %5d  engine %s  ROOT %s' % (k,' '.join('%.4g' % x for x in engine),' '.join('%.4g' % x for x in root))
+    for j,index in enumerate((4,5)):
+      if root[index] != 0:
+        worst[j] = max(worst[j],fabs(engine[index] - root[index])/fabs(root[index]))
+    h.Delete()
+  print 'largest relative differences  mean %g  sigma %g' % tuple(worst)
+  return worst
+
+def HV_summary_records(hal_stamp,volts_packets):
+  '''(hv records,board records) summarizing the volts packets of a part'''
+  mirrors = volts_packets['pktHdr_crate'].astype(numpy.int64)
+  entries = volts_packets.entries()
+  tubes = numpy.arange(len(entries)) - volts_packets.offsets[entries]
+  hv = volts_packets['hv'].astype(numpy.float64)
+  keys = mirrors[entries]*65536 + tubes
+  unique,groups = numpy.unique(keys,return_inverse=True)
+  records = numpy.zeros(len(unique),dtype=HV_summary_dtype)
+  records['hal_stamp'] = hal_stamp_key(hal_stamp)
+  records['mirror'],records['tube'] = unique/65536,unique%65536
+  records['n'] = numpy.bincount(groups,minlength=len(unique))
+  records['sum'] = numpy.bincount(groups,hv,len(unique))
+  records['sumsq'] = numpy.bincount(groups,hv**2,len(unique))
+  records['min'],records['max'] = numpy.inf,-numpy.inf
+  numpy.minimum.at(records['min'],groups,hv)
+  numpy.maximum.at(records['max'],groups,hv)
+  unique,groups = numpy.unique(mirrors,return_inverse=True)
+  boards = numpy.zeros(len(unique),dtype=board_summary_dtype)
+  boards['hal_stamp'] = hal_stamp_key(hal_stamp)
+  boards['mirror'] = unique
+  boards['n'] = numpy.bincount(groups,minlength=len(unique))
+  for field in board_fields:
+    boards[field] = numpy.bincount(groups,volts_packets[field].astype(numpy.float64),len(unique))/boards['n']
+  return records,boards
+
+def merge_HV_summary(summary,chunk):
+  '''merge two (hv records,board records) summaries of the same part, e.g.
+  of successive chunks of its volts packets'''
+  records = numpy.concatenate((summary[0],chunk[0]))
+  unique,groups = numpy.unique(records['mirror'].astype(numpy.int64)*65536 + records['tube'],return_inverse=True)
+  merged = numpy.zeros(len(unique),dtype=HV_summary_dtype)
+  merged['hal_stamp'] = records['hal_stamp'][:len(unique)]
+  merged['mirror'],merged['tube'] = unique/65536,unique%65536
+  for field in ('n','sum','sumsq'):
+    merged[field] = numpy.bincount(groups,records[field].astype(numpy.float64),len(unique))
+  merged['min'],merged['max'] = numpy.inf,-numpy.inf
+  numpy.minimum.at(merged['min'],groups,records['min'])
+  numpy.maximum.at(merged['max'],groups,records['max'])
+  boards = numpy.concatenate((summary[1],chunk[1]))
+  unique,groups = numpy.unique(boards['mirror'],return_inverse=True)
+  merged_boards = numpy.zeros(len(unique),dtype=board_summary_dtype)
+  merged_boards['hal_stamp'] = boards['hal_stamp'][:len(unique)]
+  merged_boards['mirror'] = unique
+  merged_boards['n'] = numpy.bincount(groups,boards['n'],len(unique))
+  for field in board_fields:
+    merged_boards[field] = numpy.bincount(groups,boards['n']*boards[field],len(unique))/merged_boards['n']
+  return merged,merged_boards
+
+def notice_records(hal_stamp,notice_packets):
+  '''(LED temp records,PTH records) parsed from the notices of a part'''
+  notice_times = packet_times(notice_packets)
+  LED_temps,PTH = [],[]
+  for entry in numpy.flatnonzero((notice_packets['type'] == 10) | (notice_packets['type'] == 17)):
+    text = str(notice_packets['text'][entry])
+    try:
+      if notice_packets['type'][entry] == 10:
+        match = re.match(LED_temp_regex,text)
+        if match == None : continue
+        LED_temps.append((hal_stamp_key(hal_stamp),notice_packets['pktHdr_crate'][entry],notice_times[entry]) + tuple(float(temp) for temp in match.groups()))
+      else:
+        match = re.match(PTH_regex,text)
+        if match == None : continue
+        groups = match.groups()
+        PTH.append((hal_stamp_key(hal_stamp),int(groups[0]),notice_times[entry],float(groups[1]),float(groups[2]),float(groups[3])))
+    except ValueError:
+      continue
+  return numpy.array(LED_temps,dtype=LED_temp_dtype),numpy.array(PTH,dtype=PTH_dtype)
+
+def fill_profile_moments(profile,x,n,sum,sumsq):
+  '''add n values of known sum and sum of squares at each x of a TProfile, as
+  if they had been filled one at a time'''
+  if profile.GetSumw2N() == 0 : profile.Sumw2()
+  sumw2 = profile.GetSumw2()
+  for x,n,sum,sumsq in izip(x,n,sum,sumsq):
+    bin = profile.FindBin(x)
+    # TProfile bins hold the sum of the values, the sum of their squares and
+    # the count; GetBinContent is their mean
+    total = profile.GetBinContent(bin)*profile.GetBinEntries(bin)
+    profile.SetBinEntries(bin,profile.GetBinEntries(bin) + n)
+    profile.SetBinContent(bin,total + sum)
+    sumw2.AddAt(sumw2.At(bin) + sumsq,bin)
+  profile.ResetStats()
+
+class Packet:
+  '''one entry of a Packets table, standing in for the THPKT1_DST_* object
+  that GetEntry would have filled'''
+  __slots__ = ('packets','entry')
+
+  def __init__(self,packets,entry):
+    self.packets = packets
+    self.entry = entry
+
+  def __getattr__(self,field):
+    return self.packets.field(field,self.entry)
+
+class Packets:
+  '''columnar copy of one branch of one part.  Scalar fields are arrays with
+  one value per entry.  Ragged fields are stored flat, and entry i of a
+  ragged field is field[offsets[i]:offsets[i + 1]]'''
+
+  def __init__(self,branch_type,columns,offsets):
+    self.branch_type = branch_type
+    self.columns = columns
+    self.offsets = offsets
+    self.ragged = packet_fields[branch_type][2]
+
+  def __len__(self):
+    return len(self.columns[packet_fields[self.branch_type][0][0]])
+
+  def __getitem__(self,field):
+    return self.columns[field]
+
+  def __iter__(self):
+    for entry in xrange(len(self)):
+      yield self.packet(entry)
+
+  def packet(self,entry):
+    return Packet(self,entry)
+
+  def field(self,field,entry):
+    if field in self.ragged:
+      return self.columns[field][self.offsets[entry]:self.offsets[entry + 1]]
+    return self.columns[field][entry]
+
+  def entries(self):
+    '''entry number of each value of the ragged fields'''
+    return numpy.repeat(numpy.arange(len(self)),numpy.diff(self.offsets))
+
+  def slice(self,first,stop):
+    '''Packets of entries first to stop, sharing this table's columns'''
+    if not self.ragged : return Packets(self.branch_type,dict((field,self.columns[field][first:stop]) for field in self.columns),self.offsets)
+    offsets = self.offsets[first:stop + 1]
+    columns = {}
+    for field in self.columns:
+      if field in self.ragged : columns[field] = self.columns[field][offsets[0]:offsets[-1]]
+      else : columns[field] = self.columns[field][first:stop]
+    return Packets(self.branch_type,columns,offsets - offsets[0])
+
+  def chunks(self,chunk=10000):
+    for first in xrange(0,len(self),chunk):
+      yield self.slice(first,min(first + chunk,len(self)))
+
+def ragged_values(values,n):
+  '''the first n values of a PyROOT array buffer, copied in one call when the
+  buffer exposes its C type, widened as numpy.array would widen a list'''
+  typecode = getattr(values,'typecode',None)
+  if typecode == None : return numpy.array([values[i] for i in xrange(n)])
+  values = numpy.frombuffer(values,dtype=typecode,count=n)
+  if values.dtype.kind in 'biu' : return values.astype(numpy.int64)
+  return values.astype(numpy.float64)
+
+def read_packets(branch,branch_type,first=0,stop=None):
+  '''Packets of entries first to stop (default all) of a branch, with the
+  THPKT1_DST_* field names as columns.  Each entry still takes a GetEntry,
+  but its scalar fields are fetched in one attrgetter call and each ragged
+  field in one buffer copy'''
+  fields,count,ragged = packet_fields[branch_type]
+  if stop == None : stop = branch.GetEntries()
+  packet = packet_classes[branch_type]()
+  branch.SetAddress(AddressOf(packet))
+  scalars = attrgetter(*fields)
+  rows = []
+  values = dict((field,[]) for field in ragged)
+  offsets = [0]
+  for entry in xrange(first,stop):
+    branch.GetEntry(entry)
+    rows.append(scalars(packet))
+    if ragged:
+      if count == None : n = len(getattr(packet,ragged[0]))
+      else : n = getattr(packet,count)
+      for field in ragged:
+        values[field].append(ragged_values(getattr(packet,field),n))
+      offsets.append(offsets[-1] + n)
+  columns = {}
+  for field,column in zip(fields,zip(*rows) or [[]]*len(fields)):
+    columns[field] = numpy.array(column)
+  for field in ragged:
+    columns[field] = numpy.concatenate([value for value in values[field] if len(value)] or [numpy.array([])])
+  return Packets(branch_type,columns,numpy.array(offsets,dtype=numpy.int64))
+
+def iter_packets(branch,branch_type,chunk=10000):
+  '''read a branch chunk entries at a time, as Packets, so that memory is
+  bounded by the chunk rather than the part.  Chunks follow the branch's own
+  entries:  branches are filled one by one, so the tree may count fewer'''
+  entries = branch.GetEntries()
+  for first in xrange(0,entries,chunk):
+    yield read_packets(branch,branch_type,first,min(first + chunk,entries))
+
+class PacketCache:
+  '''per part columnar cache of the event, notice, time and volts branches,
+  written once from each ROOT file as .npy files and memory mapped on load'''
+
+  def __init__(self,cache_dir='/home/findlay/data/cache/packets/'):
+    self.cache_dir = cache_dir
+
+  def path(self,kind,hal_stamp,branch_type):
+    return os.path.join(self.cache_dir,kind,str(hal_stamp),branch_type)
+
+  def is_current(self,kind,hal_stamp,branch_type,root_file):
+    path = self.path(kind,hal_stamp,branch_type)
+    return os.path.isdir(path) and os.path.getmtime(path) >= os.path.getmtime(root_file)
+
+  def build(self,kind,hal_stamp,branch_type,branch):
+    packets = read_packets(branch,branch_type)
+    # write into a scratch directory and move it into place so that readers
+    # never see a partially written part
+    path = self.path(kind,hal_stamp,branch_type)
+    tmp_path = path + '.tmp'
+    if os.path.isdir(tmp_path):
+      shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for field in packets.columns:
+      numpy.save(os.path.join(tmp_path,'%s.npy' % field),packets[field])
+    numpy.save(os.path.join(tmp_path,'offsets.npy'),packets.offsets)
+    if os.path.isdir(path):
+      shutil.rmtree(path)
+    os.rename(tmp_path,path)
+
+  def get(self,kind,hal_stamp,branch_type,root_file):
+    '''load the packets of a part, first building them from root_file if the
+    cache is stale.  This opens the file itself, for use outside of Data'''
+    if not self.is_current(kind,hal_stamp,branch_type,root_file):
+      tfile = TFile(root_file)
+      self.build(kind,hal_stamp,branch_type,tfile.Get('T').GetBranch(branch_type))
+      tfile.Close()
+    return self.load(kind,hal_stamp,branch_type)
+
+  def load(self,kind,hal_stamp,branch_type):
+    path = self.path(kind,hal_stamp,branch_type)
+    fields,count,ragged = packet_fields[branch_type]
+    columns = {}
+    for field in fields + ragged:
+      columns[field] = numpy.load(os.path.join(path,'%s.npy' % field),mmap_mode='r')
+    offsets = numpy.load(os.path.join(path,'offsets.npy'),mmap_mode='r')
+    return Packets(branch_type,columns,offsets)
+
+class RecordStore:
+  '''append-only binary file of fixed size records, memory mapped on load and
+  indexed on the fields named in index (in that order).
+
+  Records are appended a part at a time, and each part is then recorded in a
+  journal beside the store as "hal_stamp first stop".  The journal says which
+  parts are done and which records are valid:  records past the journal (an
+  interrupted write) are ignored, and a reprocessed part supersedes its
+  earlier records.  A store without a journal is all valid.
+
+  Writers hold the store's lock from recover to their last append_part, so
+  that one writer never cuts off or overlaps the parts of another.'''
+
+  def __init__(self,path,dtype,index=()):
+    self.path = path
+    self.journal_file = path + '.parts'
+    self.lock_file = None
+    self.dtype = numpy.dtype(dtype)
+    self.index = index
+    self.records = None
+
+  def __len__(self):
+    if not os.path.isfile(self.path) : return 0
+    return os.path.getsize(self.path)/self.dtype.itemsize
+
+  def lock(self):
+    '''take the writer lock of the store, waiting for any other writer'''
+    if not os.path.isdir(os.path.split(self.path)[0]):
+      os.makedirs(os.path.split(self.path)[0])
+    self.lock_file = file(self.path + '.lock','a')
+    fcntl.flock(self.lock_file.fileno(),fcntl.LOCK_EX)
+
+  def unlock(self):
+    if self.lock_file == None : return
+    fcntl.flock(self.lock_file.fileno(),fcntl.LOCK_UN)
+    self.lock_file.close()
+    self.lock_file = None
+
+  def append(self,records):
+    if len(records) == 0 : return
+    if not os.path.isdir(os.path.split(self.path)[0]):
+      os.makedirs(os.path.split(self.path)[0])
+    store = file(self.path,'ab')
+    numpy.array(records,dtype=self.dtype).tofile(store)
+    store.flush()
+    os.fsync(store.fileno())
+    store.close()
+    self.records = None
+
+  def append_part(self,hal_stamp,records):
+    '''append the records of a part, then journal the part as done'''
+    first = len(self)
+    self.append(records)
+    journal = file(self.journal_file,'a')
+    journal.write('%d %d %d\n' % (hal_stamp_key(hal_stamp),first,first + len(records)))
+    journal.flush()
+    os.fsync(journal.fileno())
+    journal.close()
+
+  def parts(self):
+    '''record ranges (first,stop) of the journaled parts, by hal stamp key'''
+    parts = {}
+    if os.path.isfile(self.journal_file):
+      for line in file(self.journal_file):
+        fields = line.split()
+        if not line.endswith('\n') or len(fields) != 3 : continue # torn write
+        hal_stamp,first,stop = [int(field) for field in fields]
+        parts[hal_stamp] = (first,stop)
+    return parts
+
+  def recover(self):
+    '''cut off records written after the last journaled part; only a writer
+    holding the lock should call this'''
+    if not os.path.isfile(self.journal_file):
+      self.rebuild_journal()
+      return
+    journal = file(self.journal_file,'r+b')
+    text = journal.read()
+    if not text.endswith('\n'): # torn final line
+      journal.truncate(text.rfind('\n') + 1)
+    journal.close()
+    stops = [stop for first,stop in self.parts().values()]
+    size = max(stops + [0])*self.dtype.itemsize
+    if os.path.isfile(self.path) and os.path.getsize(self.path) > size:
+      store = file(self.path,'r+b')
+      store.truncate(size)
+      store.close()
+    self.records = None
+
+  def rebuild_journal(self):
+    '''journal each run of records of the same hal stamp as a part'''
+    records = self.load()
+    journal = file(self.journal_file + '.tmp','w')
+    if len(records):
+      starts = numpy.flatnonzero(numpy.diff(records['hal_stamp'])) + 1
+      firsts = [0] + starts.tolist()
+      stops = starts.tolist() + [len(records)]
+      for first,stop in zip(firsts,stops):
+        journal.write('%d %d %d\n' % (records['hal_stamp'][first],first,stop))
+    journal.close()
+    os.rename(self.journal_file + '.tmp',self.journal_file)
+    self.records = None
+
+  def last(self):
+    '''the last record, read without loading the rest'''
+    if len(self) == 0 : return None
+    return numpy.memmap(self.path,self.dtype,'r',offset=(len(self) - 1)*self.dtype.itemsize,shape=(1,))[0]
+
+  def load(self):
+    if self.records is None:
+      if len(self) == 0:
+        self.records = numpy.zeros(0,dtype=self.dtype)
+      else:
+        self.records = numpy.memmap(self.path,self.dtype,'r',shape=(len(self),))
+      if os.path.isfile(self.journal_file):
+        valid = numpy.zeros(len(self.records),dtype=bool)
+        for first,stop in self.parts().values():
+          valid[first:stop] = True
+        if not valid.all():
+          self.records = self.records[valid]
+      self.order = numpy.lexsort([self.records[field] for field in reversed(self.index)])
+      self.sorted = dict((field,self.records[field][self.order]) for field in self.index)
+    return self.records
+
+  def select(self,**values):
+    '''records whose fields equal values, in store order within each index key'''
+    records = self.load()
+    lo,hi = 0,len(records)
+    indexed = []
+    for field in self.index:
+      if not field in values : break
+      column = self.sorted[field][lo:hi]
+      lo,hi = lo + numpy.searchsorted(column,values[field],'left'),lo + numpy.searchsorted(column,values[field],'right')
+      indexed.append(field)
+    selected = records[numpy.sort(self.order[lo:hi])]
+    for field in values:
+      if not field in indexed:
+        selected = selected[selected[field] == values[field]]
+    return selected
+
+def lock_stores(stores):
+  '''lock several stores, always in the same order so that writers of
+  overlapping sets of stores cannot deadlock'''
+  for store in sorted(stores,key=lambda store:store.path) : store.lock()
+
+def unlock_stores(stores):
+  for store in stores : store.unlock()
+
+class Catalog:
+  '''on-disk index of the parts below a directory, mapping (kind,hal stamp) to
+  the path, size and mtime of the part file and, for ROOT files, the entries
+  of each branch and the run start.  Updates only list the directories whose
+  mtime has changed, and only inspect the files that are new or changed'''
+
+  def __init__(self,root_dir,catalog_file):
+    self.root_dir = root_dir
+    self.catalog_file = catalog_file
+    self.dirs = {} # dir:(mtime,subdirs,files)
+    self.parts = {} # (kind,hal_stamp):{'path','size','mtime','entries'[,'run_start']}
+    if os.path.isfile(catalog_file):
+      catalog = file(catalog_file,'rb')
+      self.dirs,self.parts = cPickle.load(catalog)
+      catalog.close()
+
+  def update(self):
+    pending = [self.root_dir]
+    seen_dirs = set()
+    seen_files = set()
+    changed = False
+    while pending:
+      dir = pending.pop()
+      seen_dirs.add(dir)
+      mtime = os.path.getmtime(dir)
+      if not dir in self.dirs or self.dirs[dir][0] != mtime:
+        subdirs,files = [],[]
+        for name in os.listdir(dir):
+          path = os.path.join(dir,name)
+          if os.path.isdir(path) : subdirs.append(path)
+          elif re.search(kind_regex,name) and re.search(hs_regex,name) : files.append(path)
+        self.dirs[dir] = (mtime,subdirs,files)
+        changed = True
+        for path in files:
+          self.add_file(path)
+      mtime,subdirs,files = self.dirs[dir]
+      pending.extend(subdirs)
+      seen_files.update(files)
+    # forget directories and files that have gone away
+    for dir in self.dirs.keys():
+      if not dir in seen_dirs:
+        del self.dirs[dir]
+        changed = True
+    for key in self.parts.keys():
+      if not self.parts[key]['path'] in seen_files:
+        del self.parts[key]
+        changed = True
+    if changed:
+      self.save()
+
+  def add_file(self,path):
+    name = os.path.basename(path)
+    key = (re.search(kind_regex,name).group(1),re.search(hs_regex,name).group(0))
+    stat = os.stat(path)
+    part = self.parts.get(key)
+    if part != None and part['path'] == path and part['mtime'] == stat.st_mtime and part['size'] == stat.st_size:
+      return
+    self.parts[key] = {'path':path,'size':stat.st_size,'mtime':stat.st_mtime,'entries':{}}
+    if path.endswith('.root'):
+      self.inspect(self.parts[key])
+
+  def inspect(self,part):
+    '''record branch entries and run start of a ROOT part'''
+    root_file = TFile(part['path'])
+    tree = root_file.Get('T')
+    if tree != None:
+      for branch_type in branch_types:
+        branch = tree.GetBranch(branch_type)
+        if branch != None:
+          part['entries'][branch_type] = branch.GetEntries()
+      part['run_start'] = None
+      notice_branch = tree.GetBranch('notice')
+      if notice_branch != None: # missing from a truncated conversion
+        tree.SetCacheSize(tree_cache_size)
+        tree.AddBranchToCache('notice',True)
+        for notice_packets in iter_packets(notice_branch,'notice'):
+          part['run_start'] = part_run_start(notice_packets)
+          if part['run_start'] != None : break
+    root_file.Close()
+
+  def save(self):
+    if not os.path.isdir(os.path.split(self.catalog_file)[0]):
+      os.makedirs(os.path.split(self.catalog_file)[0])
+    tmp_file = self.catalog_file + '.tmp'
+    catalog = file(tmp_file,'wb')
+    cPickle.dump((self.dirs,self.parts),catalog,2)
+    catalog.close()
+    os.rename(tmp_file,self.catalog_file)
+
+  def get_parts(self,kind):
+    '''paths of the parts of a kind, by hal stamp'''
+    return dict((hal_stamp,self.parts[(part_kind,hal_stamp)]['path']) for part_kind,hal_stamp in self.parts if part_kind == kind)
+
+class Part:
+  '''branches of one part.  The ROOT file is opened, and each branch
+  resolved, only the first time that branch is asked for'''
+
+  def __init__(self,data,kind,hal_stamp):
+    self.data = data
+    self.kind = kind
+    self.hal_stamp = hal_stamp
+    self.branches = {}
+
+  def __getitem__(self,branch_type):
+    if not branch_type in self.branches:
+      tree = self.data.open_file(self.kind,self.hal_stamp).Get('T')
+      if tree == None : return None
+      self.branches[branch_type] = tree.GetBranch(branch_type)
+      tree.AddBranchToCache(branch_type,True)
+    else:
+      key = (self.kind,self.hal_stamp)
+      self.data.open_files[key] = self.data.open_files.pop(key) # most recently used
+    return self.branches[branch_type]
+
+  def close(self):
+    '''forget branches that belong to a file which has since been closed'''
+    self.branches = {}
+
 class Data:
-  def __init__(self):
+  def __init__(self,data_dir='/home/findlay/data/middle_drum/',catalog_file='/home/findlay/data/cache/middle_drum.catalog',max_open_files=64,cache_size=tree_cache_size):
     self.files = {}
+    self.cache_size = cache_size
     self.data = {}
+    self.open_files = OrderedDict() # least recently used first
+    self.max_open_files = max_open_files
+    self.packets = {}
+    self.run_starts = {}
+    self.packet_cache = PacketCache()
+    self.catalog = Catalog(data_dir,catalog_file)
+    self.catalog.update()
     self.get_LED()
     #self.get_noise_closed()
     self.get_hvcalib()
 
   # TODO: use method decorator
   def get_LED(self):
-    find_command = 'find /home/findlay/data/middle_drum/ -type f -name "*led355*"'
-    #find_command = 'find /home/findlay/data/middle_drum/ -type f -name "*y2008m11d07p02*led355*"'
-    self.LED_data = self.get_data(find_command,kind='led355')
+    self.LED_data = self.get_data('led355')
   def get_noise_closed(self):
-    find_command = 'find /home/findlay/data/middle_drum/ -type f -name "*noise-closed*"'
-    self.LED_data = self.get_data(find_command,kind='noise-closed')
+    self.LED_data = self.get_data('noise-closed')
   def get_hvcalib(self):
-    find_command = 'find /home/findlay/data/middle_drum/ -type f -name "*hvcalib*"'
-    self.LED_data = self.get_data(find_command,kind='hvcalib')
+    self.LED_data = self.get_data('hvcalib')
 
-  def get_data(self,find_command,kind=''):
-    find = Popen(find_command,stdout=PIPE,shell=True)
-    file_names = re.split('\n',find.stdout.read())[:-1]
-    find.stdout.close()
+  def get_data(self,kind):
+    '''index the parts of a kind from the catalog; files are opened on first use'''
     self.files[kind] = {}
-    for file_name in sorted(file_names):
-      hal_stamp = HalStamp(re.search(hs_regex,file_name).group(0))
-      self.files[kind][hal_stamp] = TFile(file_name)
     self.data[kind] = {}
-    for hal_stamp in self.files[kind].keys():
-      tree = self.files[kind][hal_stamp].Get('T')
-      if tree == None : continue
-      self.data[kind][hal_stamp] = {
-          'time':tree.GetBranch('time'),
-          'event':tree.GetBranch('event'),
-          'snapshot':tree.GetBranch('snapshot'),
-          'minute':tree.GetBranch('minute'),
-          'threshold':tree.GetBranch('threshold'),
-          'countrate':tree.GetBranch('countrate'),
-          'volts':tree.GetBranch('volts'),
-          'notice':tree.GetBranch('notice'),
-          'remote':tree.GetBranch('remote'),
-          'calib':tree.GetBranch('calib'),
-          'boardid':tree.GetBranch('boardid'),
-          'mstat':tree.GetBranch('mstat')}
+    for hal_stamp,file_name in self.catalog.get_parts(kind).items():
+      hal_stamp = HalStamp(hal_stamp)
+      self.files[kind][hal_stamp] = file_name
+      self.data[kind][hal_stamp] = Part(self,kind,hal_stamp)
+
+  def get_entries(self,kind,hal_stamp,branch_type):
+    return self.catalog.parts[(kind,str(hal_stamp))]['entries'].get(branch_type,0)
+
+  def get_run_start(self,kind,hal_stamp):
+    '''epoch milliseconds of the first RUN START notice of a part, from the
+    catalog when it has been recorded there'''
+    key = (kind,hal_stamp)
+    if not key in self.run_starts:
+      part = self.catalog.parts[(kind,str(hal_stamp))]
+      if not 'run_start' in part:
+        part['run_start'] = part_run_start(self.get_packets(kind,hal_stamp,'notice'))
+        self.catalog.save()
+      self.run_starts[key] = part['run_start']
+    return self.run_starts[key]
+
+  def open_file(self,kind,hal_stamp):
+    '''return the open TFile of a part, closing the least recently used file
+    once more than max_open_files are open'''
+    key = (kind,hal_stamp)
+    if key in self.open_files:
+      root_file = self.open_files.pop(key)
+    else:
+      root_file = TFile(self.files[kind][hal_stamp])
+      tree = root_file.Get('T')
+      if tree != None : tree.SetCacheSize(self.cache_size)
+      while len(self.open_files) >= self.max_open_files:
+        (old_kind,old_hal_stamp),old_file = self.open_files.popitem(last=False)
+        self.data[old_kind][old_hal_stamp].close()
+        old_file.Close()
+    self.open_files[key] = root_file
+    return root_file
+
+  def get_packets(self,kind,hal_stamp,branch_type):
+    '''columnar packets of one branch of a part, building the cache entry from
+    the ROOT file the first time it is needed'''
+    key = (kind,hal_stamp,branch_type)
+    if not key in self.packets:
+      root_file = self.files[kind][hal_stamp]
+      if not self.packet_cache.is_current(kind,hal_stamp,branch_type,root_file):
+        self.packet_cache.build(kind,hal_stamp,branch_type,self.data[kind][hal_stamp][branch_type])
+      self.packets[key] = self.packet_cache.load(kind,hal_stamp,branch_type)
+    return self.packets[key]
+
+  def iter_packets(self,kind,hal_stamp,branch_type,chunk=10000):
+    '''read one branch of a part straight from the ROOT file, through the tree
+    cache, as Packets of whole clusters of about chunk entries'''
+    return iter_packets(self.data[kind][hal_stamp][branch_type],branch_type,chunk)
 
   def print_packets(self,branch_type,kind='led355',hal_stamp=None):
     if hal_stamp == None:
@@ -205,6 +1111,16 @@ class Data:
         if branch_type == 'volts'  : print hal_stamp,packet.pktHdr_crate,packet.minute,packet.obVer,packet.hvChnls,packet.ob_p12v,packet.ob_p05v,packet.ob_n12v,packet.ob_n05v,packet.ob_tdcRef,packet.ob_temp,packet.ob_thRef,packet.ob_gnd,packet.garb_temp,packet.garb_p12v,packet.garb_n12v,packet.garb_p05v,packet.garb_s05v,packet.garb_lemo1,packet.garb_anlIn,packet.garb_clsVolts,packet.garb_clsTemp,packet.garb_mirX,packet.garb_mirY,packet.garb_clsX,packet.garb_clsY,packet.garb_ns,packet.garb_hvSup,packet.garb_hvChnl,packet.cluster,packet.hv
       print '%s  %5d' % (hal_stamp,branch.GetEntries())
 
+def derived_stores(data_dir='/home/findlay/data/'):
+  '''the record stores derived from the led355 parts, by name'''
+  return {
+      'flash_stats_cluster':RecordStore(data_dir + 'flash_stats_cluster.dat',flash_stats_dtype,('mirror','tube','hal_stamp')),
+      'flash_stats_tube':RecordStore(data_dir + 'flash_stats_tube.dat',flash_stats_dtype,('mirror','tube','hal_stamp')),
+      'HV_summary':RecordStore(data_dir + 'HV_summary.dat',HV_summary_dtype,('mirror','tube','hal_stamp')),
+      'board_summary':RecordStore(data_dir + 'board_summary.dat',board_summary_dtype,('mirror','hal_stamp')),
+      'LED_temps':RecordStore(data_dir + 'LED_temps.dat',LED_temp_dtype,('mirror','hal_stamp')),
+      'PTH':RecordStore(data_dir + 'PTH.dat',PTH_dtype,('mirror','hal_stamp'))}
+
 class Plot:
   def __init__(self):
     gROOT.Reset()
@@ -214,17 +1130,18 @@ class Plot:
 
     self.data_object = Data()
     self.data = self.data_object.data
-    if os.path.isfile('/home/findlay/data/flash_stats_cluster.gz'):
-      self.flash_stats_cluster_file = gzip.open('/home/findlay/data/flash_stats_cluster.gz','r')
-    if os.path.isfile('/home/findlay/data/flash_stats_tube.gz'):
-      self.flash_stats_tube_file = gzip.open('/home/findlay/data/flash_stats_tube.gz','r')
+    stores = derived_stores()
+    self.flash_stats_cluster = stores['flash_stats_cluster']
+    self.flash_stats_tube = stores['flash_stats_tube']
+    self.HV_summary = stores['HV_summary']
+    self.board_summary = stores['board_summary']
     if os.path.isfile('/home/findlay/data/hv_calib.txt'):
       self.HV_calib_file = file('/home/findlay/data/hv_calib.txt','r')
-    #hal_stamp := year month day part mirror
-    self.flash_stats_cluster_regex = re.compile(r'^(\d+) (y\d{4}m\d{2}d\d{2}p\d{2})m(\d{2}) (\d+) (\d+) (\S+) (\S+) (\S+) (\S+) (\S+)$')
-    self.flash_stats_tube_regex    = re.compile(r'^(\d+) (y\d{4}m\d{2}d\d{2}p\d{2})m(\d{2})t(\d{3}) (\d+) (\d+) (\S+) (\S+) (\S+) (\S+) (\S+)$')
-    self.LED_temp_regex = re.compile(r'^TEMP A (\S+) B (\S+) C (\S+) D (\S+)$')
-    self.PTH_regex = re.compile(r'^m(\d{1,2}): @\d+ (\S+) (\S+) (\S+)')
+    self.HV_calib_steps = read_HV_calib_steps(os.path.join(os.path.dirname(os.path.abspath(__file__)),'hv_calib_steps.txt'))
+    self.LED_temps = stores['LED_temps']
+    self.PTH = stores['PTH']
+    self.LED_temp_regex = LED_temp_regex
+    self.PTH_regex = PTH_regex
     self.canvas = TCanvas('LED','LED canvas',1024,791)
 
     self.t0 = time()
@@ -304,14 +1221,60 @@ class Plot:
     #return mktime(strptime(re.match(r'(y\d{4}m\d{2}d\d{2})',hal_stamp.hs).group(0),'y%Ym%md%d')) - self.t0
     return mktime(hal_stamp.dt.timetuple()) - self.t0
 
+  def get_packets(self,hal_stamp,kind,branch_type):
+    return self.data_object.get_packets(kind,hal_stamp,branch_type)
+
   def get_run_start(self,hal_stamp,kind):
-    notice_branch = self.data[kind][hal_stamp]['notice']
-    notice = THPKT1_DST_NOTICE()
-    notice_branch.SetAddress(AddressOf(notice))
-    for entry in xrange(notice_branch.GetEntries()):
-      notice_branch.GetEntry(entry)
-      if notice.type == 8: # event time is measured as offset from first RUN START
-        return convert_time(notice)
+    return self.data_object.get_run_start(kind,hal_stamp)
+
+  def update_stores(self,stores,branch_type,derive,reprocess=()):
+    '''append derive(hal_stamp,packets) -> (records of each store) for each
+    led355 part missing from any of the stores, and again for the hal stamps
+    in reprocess'''
+    reprocess = [hal_stamp_key(hal_stamp) for hal_stamp in reprocess]
+    try:
+      lock_stores(stores)
+      for store in stores : store.recover()
+      done = [store.parts() for store in stores]
+      for hal_stamp in sorted(self.data['led355'].keys()):
+        key = hal_stamp_key(hal_stamp)
+        if all(key in parts for parts in done) and not key in reprocess : continue
+        for store,records in zip(stores,derive(hal_stamp,self.get_packets(hal_stamp,'led355',branch_type))):
+          store.append_part(hal_stamp,records)
+    finally:
+      unlock_stores(stores)
+
+  def update_HV_summary(self,reprocess=()):
+    '''summarize the volts packets of the led355 parts not yet in the HV and
+    board summaries, and again those of the hal stamps in reprocess'''
+    self.update_stores((self.HV_summary,self.board_summary),'volts',HV_summary_records,reprocess)
+
+  def update_notice_series(self,reprocess=()):
+    '''parse the LED temp and PTH notices of the led355 parts not yet in their
+    stores, and again those of the hal stamps in reprocess'''
+    self.update_stores((self.LED_temps,self.PTH),'notice',notice_records,reprocess)
+
+  def get_LED_temps(self,**values):
+    '''LED temp records matching values, in time order'''
+    self.update_notice_series()
+    records = self.LED_temps.select(**values)
+    return records[numpy.argsort(records['t'],kind='mergesort')]
+
+  def get_PTH(self,**values):
+    '''cluster PTH records matching values, in time order'''
+    self.update_notice_series()
+    records = self.PTH.select(**values)
+    return records[numpy.argsort(records['t'],kind='mergesort')]
+
+  def get_HV_summary(self,**values):
+    '''HV summary records matching values (e.g. mirror=6), bringing the
+    summary up to date first'''
+    self.update_HV_summary()
+    return self.HV_summary.select(**values)
+
+  def get_board_summary(self,**values):
+    self.update_HV_summary()
+    return self.board_summary.select(**values)
 
   def serialize_packets(self,hal_stamp,kind):
     start = self.get_run_start(hal_stamp,kind)